@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Benchmark for count_strategies.py
+
+Writes seeded synthetic FED3-style session CSVs (timestamp in column 0, events in column 7,
+active poke in column 8, trial in column 12 and rule shift phase in column 14), then times
+each stage of the analysis and reports rows/sec and peak memory. Results can be saved as a
+JSON baseline and compared against on later runs.
+
+    python bench_count_strategies.py --rows 1000 100000 1000000 --phases 1 5 20 --save baseline.json
+    python bench_count_strategies.py --rows 1000 100000 1000000 --phases 1 5 20 --compare baseline.json
+
+Sessions are written with FED3's zero-padded timestamps (03/01/2024 09:05:07) and with
+non-padded ones (3/1/2024 9:05:07) as other exports write them; --timestamps picks either.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import count_strategies as cs
+
+FED3_COLUMNS = [
+    'MM:DD:YYYY hh:mm:ss', 'Library_Version', 'Session_type', 'Device_Number', 'Battery_Voltage',
+    'Motor_Turns', 'FR', 'Event', 'Active_Poke', 'Left_Poke_Count', 'Right_Poke_Count',
+    'Pellet_Count', 'Trial', 'Retrieval_Time', 'Rule_Shift_Phase', 'Poke_Time',
+]
+
+# Relative frequencies of the logged events
+EVENT_WEIGHTS = {
+    'LoseStay': 0.10, 'LoseShift': 0.10, 'WinShift': 0.08, 'WinStay': 0.12,
+    'Left': 0.14, 'Right': 0.14, 'Pellet': 0.14, 'LeftWithPellet': 0.05,
+    'RightWithPellet': 0.05, 'LeftDuringDispense': 0.04, 'RightDuringDispense': 0.04,
+}
+
+# Timestamp styles of the synthetic sessions
+TIMESTAMP_STYLES = ['padded', 'unpadded']
+
+def format_timestamps(times, style):
+    # 'padded' is FED3's MM/DD/YYYY HH:MM:SS; 'unpadded' drops the leading zeros of the
+    # month, day and hour (M/D/YYYY H:MM:SS)
+    if style == 'padded':
+        return times.strftime('%m/%d/%Y %H:%M:%S')
+    return (times.month.astype(str) + '/' + times.day.astype(str) + '/' + times.year.astype(str)
+            + ' ' + times.hour.astype(str) + times.strftime(':%M:%S'))
+
+def make_session(rows, phases, seed=0, hours=3.0, timestamps='padded'):
+    """Build a synthetic FED3 session of `rows` events spread over `hours`, with the
+    phases IA, 1, 2, ... advancing in equal blocks of trials."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2024-03-01 09:00:00')
+    # Exponential gaps between events, scaled so the session lasts about `hours`
+    gaps = rng.exponential(1.0, rows)
+    seconds = np.cumsum(gaps) * (hours * 3600 / gaps.sum())
+    times = format_timestamps(start + pd.to_timedelta(np.floor(seconds), unit='s'), timestamps)
+
+    events = rng.choice(list(EVENT_WEIGHTS), rows, p=list(EVENT_WEIGHTS.values()))
+    trials = np.cumsum(np.isin(events, ['Left', 'Right']))
+    phase_numbers = np.minimum(trials * phases // (trials[-1] + 1), phases - 1)
+    phase_labels = np.array(['IA'] + [str(i) for i in range(1, phases)], dtype=object)
+    # The correct side alternates at every rule shift
+    active_poke = np.where(phase_numbers % 2 == 0, 'Left', 'Right').astype(object)
+
+    df = pd.DataFrame({
+        'MM:DD:YYYY hh:mm:ss': times,
+        'Library_Version': 'FED3_1.1.3',
+        'Session_type': 'RuleShift',
+        'Device_Number': 1,
+        'Battery_Voltage': np.round(rng.uniform(3.9, 4.2, rows), 2),
+        'Motor_Turns': rng.integers(0, 3, rows),
+        'FR': 1,
+        'Event': events,
+        'Active_Poke': active_poke,
+        'Left_Poke_Count': np.cumsum(events == 'Left'),
+        'Right_Poke_Count': np.cumsum(events == 'Right'),
+        'Pellet_Count': np.cumsum(events == 'Pellet'),
+        'Trial': trials,
+        'Retrieval_Time': np.where(events == 'Pellet', np.round(rng.exponential(2.0, rows), 2), np.nan),
+        'Rule_Shift_Phase': phase_labels[phase_numbers],
+        'Poke_Time': np.round(rng.uniform(0.05, 0.5, rows), 3),
+    })
+    return df[FED3_COLUMNS]
+
+def measure(func, *args, **kwargs):
+    """Run func once and return (result, seconds, peak MB allocated during the call)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 1e6
+
+def filter_events(df):
+    events_frame, _ = cs.build_event_frame(df, cs.PROJECTED_COLUMNS)
+    return events_frame[events_frame['correct_poke'].notna()]
+
+def rows_parsed():
+    # read_csv_window stops after the chunk that passes the first hour, so count the rows it
+    # parsed from its stage records instead of using the size of the file
+    return sum(r['rows_in'] or 0 for r in cs.stages.take_records() if r['stage'] == 'timestamp parse')
+
+def bench_session(path, rows, phases, timestamps='padded'):
+    """Time the parse, filter, count and pivot stages on one session file"""
+    results = []
+
+    def record(stage, rows_in, func, *args):
+        # rows_in may be a function, called after the stage ran
+        cs.stages.take_records()
+        result, seconds, peak_mb = measure(func, *args)
+        if callable(rows_in):
+            rows_in = rows_in()
+        results.append({
+            'rows': rows, 'phases': phases, 'timestamps': timestamps, 'stage': stage, 'rows_in': rows_in,
+            'seconds': round(seconds, 6),
+            'rows_per_sec': round(rows_in / seconds) if seconds > 0 else None,
+            'peak_mb': round(peak_mb, 3),
+        })
+        return result
+
+    # Parse: chunked read of the analysis columns, timestamp parsing and the first-hour cutoff
+    df = record('parse', rows_parsed, cs.read_csv_window, path)
+    events = record('filter', len(df), filter_events, df)
+    event_counts = record('count', len(events), cs.count_phase_events, events)
+    record('pivot', len(events), lambda: cs.build_phase_table(cs.index_phases(events), event_counts))
+    record('total', rows_parsed, lambda: cs.count_strategies(cs.read_csv_window(path),
+                                                             raise_errors=True,
+                                                             column_positions=cs.PROJECTED_COLUMNS))
+    return results
+
+def print_results(results, baseline=None):
+    baseline_index = {}
+    for entry in baseline or []:
+        # Baselines saved before the timestamp styles were added used padded timestamps
+        baseline_index[(entry['rows'], entry['phases'], entry.get('timestamps', 'padded'), entry['stage'])] = entry
+    print(f"{'rows':>10} {'phases':>6} {'stamps':<8} {'stage':<7} {'seconds':>9} {'rows/sec':>12} {'peak MB':>9}"
+          + ("   vs baseline" if baseline else ""))
+    for entry in results:
+        line = (f"{entry['rows']:>10} {entry['phases']:>6} {entry['timestamps']:<8} {entry['stage']:<7} "
+                f"{entry['seconds']:>9.4f} {entry['rows_per_sec'] or 0:>12,} {entry['peak_mb']:>9.1f}")
+        base = baseline_index.get((entry['rows'], entry['phases'], entry['timestamps'], entry['stage']))
+        if base and entry['seconds'] > 0:
+            line += f"   {base['seconds'] / entry['seconds']:.2f}x speed, {entry['peak_mb'] - base['peak_mb']:+.1f} MB"
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark count_strategies.py on synthetic FED3 sessions.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000],
+                        help="Session sizes in rows (up to 10,000,000).")
+    parser.add_argument("--phases", type=int, nargs="+", default=[1, 5, 20],
+                        help="Numbers of rule shift phases (1 to 20).")
+    parser.add_argument("--timestamps", nargs="+", choices=TIMESTAMP_STYLES, default=TIMESTAMP_STYLES,
+                        help="Timestamp styles to write: FED3's zero-padded one and/or non-padded (default: both).")
+    parser.add_argument("--hours", type=float, default=3.0, help="Length of each synthetic session.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data.")
+    parser.add_argument("--data-dir", default=None,
+                        help="Keep the generated sessions here instead of a temporary directory.")
+    parser.add_argument("--save", default=None, help="Save the results as a JSON baseline.")
+    parser.add_argument("--compare", default=None, help="Compare against a saved JSON baseline.")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = Path(args.data_dir or tmp_dir)
+        data_dir.mkdir(parents=True, exist_ok=True)
+        for rows in args.rows:
+            for phases in args.phases:
+                for style in args.timestamps:
+                    suffix = "" if style == 'padded' else f"_{style}"
+                    path = data_dir / f"fed3_{rows}rows_{phases}phases_seed{args.seed}{suffix}.csv"
+                    if not path.exists():
+                        print(f"Generating {path.name}...", file=sys.stderr)
+                        make_session(rows, phases, args.seed, args.hours, style).to_csv(path, index=False)
+                    results.extend(bench_session(str(path), rows, phases, style))
+
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': sys.version.split()[0],
+                'pandas': pd.__version__,
+                'numpy': np.__version__,
+                'seed': args.seed,
+                'hours': args.hours,
+                'results': results,
+            }, f, indent=2)
+        print(f"\nBaseline saved to: {args.save}")
+
+if __name__ == "__main__":
+    main()
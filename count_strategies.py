@@ -1,201 +1,645 @@
-import pandas as pd
-from google.colab import files
+import argparse
+import contextlib
+import hashlib
+import importlib.util
 import io
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from maze.column_layouts import LayoutCache, LayoutError
+from maze.data_loader import collect_files, file_kind, read_csv, read_excel
+from maze.fed_stages import StageRecorder, summarize, write_json_lines
+from maze.fed_time import parse_timestamps
+
+SESSION_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+
+# Positions of the time, events, correct poke, trial and rule shift phase columns
+SESSION_COLUMNS = [0, 7, 8, 12, 14]
+# The same columns in a frame read with only SESSION_COLUMNS
+PROJECTED_COLUMNS = list(range(len(SESSION_COLUMNS)))
+# Read plan of a standard FED3 header: positions to read, where each of the SESSION_COLUMNS
+# roles lands among them, and the columns read as text
+SESSION_LAYOUT = {'usecols': SESSION_COLUMNS, 'order': PROJECTED_COLUMNS, 'text_columns': [SESSION_COLUMNS[-1]]}
+
+ANALYSIS_WINDOW = timedelta(hours=1)
+
+# Define all event types to track in specific order
+EVENT_TYPES = [
+    'losestay', 'loseshift', 'winshift', 'winstay', 
+    'left', 'right', 'pellet', 'leftwithpellet', 
+    'rightwithpellet', 'leftduringdispense', 'rightduringdispense',
+    'correct', 'incorrect'  # Add new types for tracking correct/incorrect choices
+]
+COUNTED_EVENTS = EVENT_TYPES[:-2]  # Exclude correct/incorrect, which are derived per phase
+POKE_SIDES = ['left', 'right']
+STRATEGIES = ['losestay', 'loseshift', 'winstay', 'winshift']
+
+# Progress output and per-stage timings; set stages.quiet to silence the console
+stages = StageRecorder()
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "count_strategies"
+DEFAULT_CACHE_MB = 1024
+
+# Read plans per session header, shared by every file read in this process
+session_layouts = LayoutCache(DEFAULT_CACHE_DIR / "layouts.json", kind="count_strategies")
+
+def phase_sort_key(x):
+    if x == 'IA':
+        return -1
+    try:
+        return int(x)  # Convert phase number to integer for proper sorting
+    except ValueError:
+        return float('inf')  # Put any non-numeric phases at the end
+
+def encode_labels(values, vocabulary):
+    """Encode a column of labels as a categorical over a fixed vocabulary, matching case-insensitively.
+    Only the distinct labels are lowercased. Labels outside the vocabulary become missing and are
+    returned as a {label: row count} dict alongside the categorical."""
+    codes, uniques = pd.factorize(values)  # Missing values get code -1
+    lowered = pd.Index(uniques.astype(str)).str.lower()
+    lookup = pd.Index(vocabulary).get_indexer(lowered)
+    unknown = {}
+    if (lookup < 0).any():
+        unique_counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        unknown = {str(uniques[i]): int(unique_counts[i]) for i in np.flatnonzero(lookup < 0)}
+    # Append -1 so that missing values (code -1) stay missing
+    label_codes = np.append(lookup, -1)[codes]
+    return pd.Categorical.from_codes(label_codes, categories=vocabulary), unknown
+
+def build_event_frame(df, column_positions=SESSION_COLUMNS):
+    """Locate the session columns and return a narrow time/event/correct_poke/trial/phase frame,
+    plus the {column: {label: rows}} labels that fell outside the event vocabularies."""
+    time_pos, events_pos, correct_poke_pos, trial_pos, rule_shift_pos = column_positions
+    time_col = df.columns[time_pos]
+    
+    stages.log("\nLocating required columns...")
+    # Try to find the right columns, supporting both numeric and letter-based indices
+    events_col = None
+    if 'H' in df.columns:
+        events_col = 'H'
+        stages.log("Found events column 'H'")
+    elif 7 in df.columns:  # 0-based index for column H
+        events_col = 7
+        stages.log("Found events column at index 7")
+    else:
+        # Try to find the events column by position
+        try:
+            events_col = df.columns[events_pos]  # 0-based index 7 for column H
+            stages.log(f"Using column at position {events_pos}: {events_col}")
+        except IndexError:
+            stages.log("\nERROR: Could not find events column. Available columns:")
+            for i, col in enumerate(df.columns):
+                stages.log(f"Column {i}: {col}")
+            raise ValueError(f"Events column not found at position {events_pos}")
+    
+    # Get other columns by position
+    rule_shift_col = df.columns[rule_shift_pos]  # Column 15 (0-based index 14)
+    correct_poke_col = df.columns[correct_poke_pos]  # Column 9 (0-based index 8) - Active Poke column
+    trial_col = df.columns[trial_pos]  # Column 13 (0-based index 12)
+    
+    # Build a narrow working frame, encoding the events and correct poke columns
+    # once as case-insensitive categoricals over their fixed vocabularies
+    events, unknown_events = encode_labels(df[events_col], COUNTED_EVENTS)
+    correct_pokes, unknown_pokes = encode_labels(df[correct_poke_col], POKE_SIDES)
+    unknown_labels = {'event': unknown_events, 'correct poke': unknown_pokes}
+    for column, labels in unknown_labels.items():
+        if labels:
+            stages.log(f"Unknown {column} labels (not counted): {labels}")
+    return pd.DataFrame({
+        'time': parse_timestamps(df[time_col]).to_numpy(),
+        'event': events,
+        'correct_poke': correct_pokes,
+        'trial': df[trial_col].to_numpy(),
+        'phase': df[rule_shift_col].to_numpy(),
+    }), unknown_labels
+
+def count_phase_events(events_frame):
+    """Count every (phase, event) pair of the filtered event frame in one grouped pass.
+    Returns a phase x event table over COUNTED_EVENTS."""
+    # Rows without a phase are kept so they still count towards the totals
+    return (events_frame.groupby(['phase', 'event'], sort=False, dropna=False, observed=True)
+            .size()
+            .unstack('event', fill_value=0)
+            .reindex(columns=COUNTED_EVENTS, fill_value=0))
+
+class PhaseIndex:
+    """Rule shift phase boundaries of a trial-sorted event frame.
+
+    table has one row per phase in phase order (IA, 1, 2, ...) with the start and stop row
+    offsets of the phase in events, its number of rows, start and end trials, trials to
+    criterion (missing for the last phase) and correct choice. slice(phase) returns the rows
+    of one phase without scanning the frame.
+    """
+
+    def __init__(self, events, table):
+        self.events = events
+        self.table = table
+
+    @property
+    def phases(self):
+        return list(self.table.index)
+
+    def slice(self, phase):
+        start, stop = self.table.at[phase, 'start'], self.table.at[phase, 'stop']
+        if stop - start == self.table.at[phase, 'rows']:
+            return self.events.iloc[start:stop]
+        # The phase's rows are interleaved with another phase in trial order
+        return self.events[self.events['phase'] == phase]
+
+def index_phases(events_frame):
+    """Sort the filtered event frame by trial once and index where each phase starts and stops"""
+    # Sort DataFrame by trial number to ensure chronological order
+    events = events_frame.sort_values(by='trial', kind='stable').reset_index(drop=True)
+    
+    # Codes follow the order of first appearance; rows without a phase get -1
+    codes, phases = pd.factorize(events['phase'])
+    code_series = pd.Series(codes)
+    first_offsets = code_series.drop_duplicates()
+    first_offsets = first_offsets[first_offsets >= 0]
+    last_offsets = code_series.drop_duplicates(keep='last')
+    last_offsets = last_offsets[last_offsets >= 0]
+    starts = np.empty(len(phases), dtype=np.int64)
+    starts[first_offsets.to_numpy()] = first_offsets.index
+    stops = np.empty(len(phases), dtype=np.int64)
+    stops[last_offsets.to_numpy()] = last_offsets.index + 1
+    
+    table = pd.DataFrame({
+        'start': starts,
+        'stop': stops,
+        'rows': np.bincount(codes[codes >= 0], minlength=len(phases)),
+        'start_trial': events['trial'].to_numpy()[starts],
+        'end_trial': events['trial'].to_numpy()[stops - 1],
+        'correct_choice': np.asarray(events['correct_poke'], dtype=object)[starts],
+    }, index=pd.Index(np.asarray(phases, dtype=object), name='Phase'))
+    
+    # Get unique phases and sort them in correct order (IA, 1, 2, 3, etc.)
+    table = table.loc[sorted(table.index, key=phase_sort_key)]
+    # Trials to criterion: from the first trial of a phase to the first trial of the next one
+    table['trials_to_criterion'] = table['start_trial'].shift(-1) - table['start_trial']
+    return PhaseIndex(events, table)
+
+def build_phase_table(phase_index, event_counts):
+    """Build the events x phases table of count_strategies() from the phase index and the
+    phase x event counts: adds correct/incorrect, trials to criterion and % rows."""
+    table = phase_index.table
+    unique_phases = phase_index.phases
+    stages.log(f"\nFound rule shift phases in order: {unique_phases}")
+    
+    # Pivot to events x phases, with the phases in sorted order
+    phase_counts_pivot = event_counts.loc[unique_phases].T
+    
+    # Correct: when the event matches the correct choice
+    # Incorrect: when the event is the opposite choice (if correct is 'left', only count 'right' as incorrect)
+    correct_counts = {}
+    incorrect_counts = {}
+    for phase, correct_choice in table['correct_choice'].items():
+        opposite_choice = 'right' if correct_choice == 'left' else 'left'
+        correct_counts[phase] = event_counts.at[phase, correct_choice]
+        incorrect_counts[phase] = event_counts.at[phase, opposite_choice]
+    
+    phase_counts_pivot.loc['correct'] = pd.Series(correct_counts)
+    phase_counts_pivot.loc['incorrect'] = pd.Series(incorrect_counts)
+    
+    # Add the trials to criterion row
+    phase_counts_pivot.loc['trials to criterion'] = table['trials_to_criterion']
+    
+    # Convert all values in the DataFrame to integers
+    phase_counts_pivot = phase_counts_pivot.fillna(0).astype(int)
+    
+    # Rename columns to include correct choice
+    phase_counts_pivot.columns = [f"{phase} [{choice.upper()}]" for phase, choice in table['correct_choice'].items()]
+    
+    # Calculate percentages for each phase from only the four strategies and add as new rows
+    strategy_counts = phase_counts_pivot.loc[STRATEGIES]
+    strategy_totals = strategy_counts.sum()
+    percentages = (strategy_counts / strategy_totals.where(strategy_totals > 0)) * 100
+    percentages = percentages.fillna(0).apply(lambda col: col.map('{:.1f}'.format))
+    percentages.index = [f'% {strategy}' for strategy in STRATEGIES]
+    
+    phase_counts_pivot = pd.concat([phase_counts_pivot.astype(object), percentages])
+    phase_counts_pivot.index.name = 'Event'
+    return phase_counts_pivot
 
-def count_strategies(df):
+def count_strategies(df, raise_errors=False, column_positions=SESSION_COLUMNS):
+    time_pos = column_positions[0]
     try:
-        print("\nStarting data processing...")
-        print(f"Initial columns: {df.columns.tolist()}")
+        stages.log("\nStarting data processing...")
+        stages.log(f"Initial columns: {df.columns.tolist()}")
         
         # Convert the first column to datetime
-        time_col = df.columns[0]
-        print(f"\nConverting time column: {time_col}")
+        time_col = df.columns[time_pos]
+        stages.log(f"\nConverting time column: {time_col}")
         try:
-            df[time_col] = pd.to_datetime(df[time_col])
+            with stages.stage('timestamp parse', rows_in=len(df)) as counts:
+                df[time_col] = parse_timestamps(df[time_col])
+                counts['rows_out'] = len(df)
         except Exception as e:
-            print(f"Error converting time column: {str(e)}")
-            print(f"First few values of time column:\n{df[time_col].head()}")
+            stages.log(f"Error converting time column: {str(e)}")
+            stages.log(f"First few values of time column:\n{df[time_col].head()}")
             raise
         
         # Get the timestamp of the first event
         first_event_time = df[time_col].min()
-        print(f"\nFirst event time: {first_event_time}")
+        stages.log(f"\nFirst event time: {first_event_time}")
         
         # Calculate the cutoff time (1 hour after first event)
-        cutoff_time = first_event_time + timedelta(hours=1)
-        print(f"Cutoff time: {cutoff_time}")
+        cutoff_time = first_event_time + ANALYSIS_WINDOW
+        stages.log(f"Cutoff time: {cutoff_time}")
         
         # Filter dataframe to only include events within the first hour
-        df = df[df[time_col] <= cutoff_time]
-        print(f"Events within first hour: {len(df)}")
+        with stages.stage('cutoff filter', rows_in=len(df)) as counts:
+            df = df[df[time_col] <= cutoff_time]
+            counts['rows_out'] = len(df)
+        stages.log(f"Events within first hour: {len(df)}")
         
-        print("\nLocating required columns...")
-        # Try to find the right columns, supporting both numeric and letter-based indices
-        events_col = None
-        if 'H' in df.columns:
-            events_col = 'H'
-            print("Found events column 'H'")
-        elif 7 in df.columns:  # 0-based index for column H
-            events_col = 7
-            print("Found events column at index 7")
-        else:
-            # Try to find the events column by position
-            try:
-                events_col = df.columns[7]  # 0-based index for column H
-                print(f"Using column at position 7: {events_col}")
-            except IndexError:
-                print("\nERROR: Could not find events column. Available columns:")
-                for i, col in enumerate(df.columns):
-                    print(f"Column {i}: {col}")
-                raise ValueError("Events column not found at position 7")
-        
-        # Get other columns by position
-        rule_shift_col = df.columns[14]  # Column 15 (0-based index 14)
-        active_poke_col = df.columns[7]  # Column 8 (0-based index 7) - Events column
-        correct_poke_col = df.columns[8]  # Column 9 (0-based index 8) - Active Poke column
-        trial_col = df.columns[12]  # Column 13 (0-based index 12)
-        
-        # Create a copy of the DataFrame to avoid SettingWithCopyWarning
-        df = df.copy()
-        
-        # Convert all relevant columns to lowercase for case-insensitive matching
-        df[events_col] = df[events_col].astype(str).str.lower()
-        df[active_poke_col] = df[active_poke_col].astype(str).str.lower()
-        df[correct_poke_col] = df[correct_poke_col].astype(str).str.lower()
-        
-        # Define all event types to track in specific order
-        event_types = [
-            'losestay', 'loseshift', 'winshift', 'winstay', 
-            'left', 'right', 'pellet', 'leftwithpellet', 
-            'rightwithpellet', 'leftduringdispense', 'rightduringdispense',
-            'correct', 'incorrect'  # Add new types for tracking correct/incorrect choices
-        ]
-        
-        # Filter for rows where active_poke is 'left' or 'right' and create a new DataFrame
-        df = df[df[correct_poke_col].isin(['left', 'right'])]
-        
-        # Get total counts using exact matching
-        total_counts = {}
-        for event in event_types[:-2]:  # Exclude correct/incorrect
-            total_counts[event] = df[df[events_col].str.lower() == event.lower()].shape[0]
-        
-        # Convert total counts to DataFrame with specific order
-        total_counts_df = pd.DataFrame([(event, total_counts[event]) for event in event_types[:-2]],
-                                     columns=['TOTAL', 'FREQUENCY'])
-        total_counts_df.set_index('TOTAL', inplace=True)
-        
-        # Sort DataFrame by trial number to ensure chronological order
-        df = df.sort_values(by=trial_col)
-        
-        # Get unique phases and sort them in correct order (IA, 1, 2, 3, etc.)
-        def phase_sort_key(x):
-            if x == 'IA':
-                return -1
-            try:
-                return int(x)  # Convert phase number to integer for proper sorting
-            except ValueError:
-                return float('inf')  # Put any non-numeric phases at the end
-        
-        unique_phases = sorted(df[rule_shift_col].unique(), key=phase_sort_key)
-        print(f"\nFound rule shift phases in order: {unique_phases}")
-        
-        # Create a DataFrame for phase-specific counts
-        phase_data = []
-        phase_correct_choices = {}  # Store the correct choice for each phase
-        trials_to_shift = {}  # For tracking trials between phases
-        
-        # First pass: get correct choices for each phase
-        for phase in unique_phases:
-            phase_df = df[df[rule_shift_col] == phase]
-            if not phase_df.empty:
-                correct_choice = phase_df[correct_poke_col].iloc[0].lower()
-                phase_correct_choices[phase] = correct_choice
-        
-        # Second pass: count events for each phase
-        for i, phase in enumerate(unique_phases):
-            phase_df = df[df[rule_shift_col] == phase]
-            if phase_df.empty:
-                continue
-                
-            correct_choice = phase_correct_choices[phase]
-            
-            # Get counts for this phase using exact matching
-            counts = {}
-            for event in event_types[:-2]:  # Exclude correct/incorrect
-                counts[event] = phase_df[phase_df[events_col].str.lower() == event.lower()].shape[0]
-            
-            # Count correct and incorrect choices for this phase only
-            # Correct: when the event matches the correct choice
-            # Incorrect: when the event is the opposite choice (if correct is 'left', only count 'right' as incorrect)
-            opposite_choice = 'right' if correct_choice == 'left' else 'left'
-            
-            # Use phase_df to only count events in the current phase
-            correct_count = phase_df[phase_df[events_col].str.lower() == correct_choice].shape[0]
-            incorrect_count = phase_df[phase_df[events_col].str.lower() == opposite_choice].shape[0]
-            
-            counts['correct'] = correct_count
-            counts['incorrect'] = incorrect_count
-            
-            # Add to phase data
-            for event in event_types:  # Include correct/incorrect
-                phase_data.append({
-                    'Phase': phase,
-                    'Event': event,
-                    'Count': counts[event]
-                })
+        with stages.stage('column normalization', rows_in=len(df)) as counts:
+            events_frame, unknown_labels = build_event_frame(df, column_positions)
             
-            # Calculate trials to shift
-            if i > 0:  # Skip first phase (IA) as it's the starting point
-                phase_start_trial = phase_df[trial_col].iloc[0]  # First trial of current phase
-                prev_phase_start = df[df[rule_shift_col] == unique_phases[i-1]][trial_col].iloc[0]  # First trial of previous phase
-                trials_to_shift[unique_phases[i-1]] = phase_start_trial - prev_phase_start
+            # Filter for rows where the correct poke is 'left' or 'right'
+            df = events_frame[events_frame['correct_poke'].notna()]
+            counts['rows_out'] = len(df)
         
-        # Convert phase counts to DataFrame
-        phase_counts_df = pd.DataFrame(phase_data)
-        
-        # Pivot the phase counts to create a nice table with specific event order
-        # Ensure phases are in the correct order by specifying the columns parameter
-        phase_counts_pivot = phase_counts_df.pivot(index='Event', 
-                                                 columns='Phase', 
-                                                 values='Count')
-        
-        # Reorder the columns to match the sorted unique_phases
-        phase_counts_pivot = phase_counts_pivot[unique_phases]
-        
-        # Reorder the index to match event_types order
-        phase_counts_pivot = phase_counts_pivot.reindex(event_types)
-        
-        # Add the trials to criterion row
-        phase_counts_pivot.loc['trials to criterion'] = pd.Series(trials_to_shift)
-        
-        # Convert all values in the DataFrame to integers
-        phase_counts_pivot = phase_counts_pivot.fillna(0).astype(int)
-        
-        # Rename columns to include correct choice
-        phase_counts_pivot.columns = [f"{phase} [{phase_correct_choices[phase].upper()}]" for phase in unique_phases]
+        with stages.stage('counting', rows_in=len(df)) as counts:
+            event_counts = count_phase_events(df)
+            
+            # Total counts are the column sums of the phase x event table
+            total_counts_df = pd.DataFrame({'TOTAL': COUNTED_EVENTS,
+                                            'FREQUENCY': event_counts.sum().to_numpy()})
+            total_counts_df.set_index('TOTAL', inplace=True)
+            total_counts_df.attrs['unknown_labels'] = unknown_labels
+            counts['rows_out'] = len(event_counts)
         
-        # Calculate percentages for each phase and add as new rows
-        for phase in unique_phases:
-            strategy_counts = phase_counts_pivot.loc[['losestay', 'loseshift', 'winstay', 'winshift'], phase]
-            # Calculate total only from the four strategies
-            strategy_total = sum(phase_counts_pivot.loc[strategy, phase] for strategy in ['losestay', 'loseshift', 'winstay', 'winshift'])
-            if strategy_total > 0:
-                for strategy in ['losestay', 'loseshift', 'winstay', 'winshift']:
-                    count = phase_counts_pivot.loc[strategy, phase]
-                    percentage = (count / strategy_total) * 100
-                    phase_counts_pivot.at[f'% {strategy}', phase] = f"{percentage:.1f}"
-            else:
-                for strategy in ['losestay', 'loseshift', 'winstay', 'winshift']:
-                    phase_counts_pivot.at[f'% {strategy}', phase] = "0.0"
+        with stages.stage('pivot', rows_in=len(df)) as counts:
+            phase_index = index_phases(df)
+            phase_counts_pivot = build_phase_table(phase_index, event_counts)
+            counts['rows_out'] = len(phase_counts_pivot)
         
-        return total_counts_df, phase_counts_pivot, None
+        return total_counts_df, phase_counts_pivot, phase_index
         
     except Exception as e:
-        print(f"\nError processing data: {str(e)}")
+        if raise_errors:
+            raise
+        stages.log(f"\nError processing data: {str(e)}")
         return None, None, None
 
+def count_strategy_windows(df, windows=None, step=None, width=None, column_positions=SESSION_COLUMNS):
+    """Count the four strategies per phase for many time windows in one pass.
+
+    Pass either windows, a list of timedeltas that all start at the first event (like the
+    one-hour cutoff of count_strategies), or step and width for sliding windows that start
+    every step after the first event. Like the cutoff, a window includes both of its ends.
+    Each (phase, strategy) pair's timestamps are sorted once, so a window's count is the
+    difference of two positions in them and more windows cost only a binary search each.
+    When reading with read_session_window(), pass the longest window so no rows are cut.
+
+    Returns one row per window and phase with events in it: window_start, window_end, phase,
+    the strategy counts and their '% strategy' shares.
+    """
+    if windows is None and (step is None or width is None):
+        raise ValueError("Pass either windows or both step and width")
+    events_frame, _ = build_event_frame(df, column_positions)
+    events_frame = events_frame[events_frame['time'].notna()]
+    first_event_time = events_frame['time'].min()
+    
+    if windows is not None:
+        starts = pd.DatetimeIndex([first_event_time] * len(windows))
+        ends = starts + pd.to_timedelta(list(windows))
+    else:
+        starts = pd.date_range(first_event_time, events_frame['time'].max(), freq=pd.to_timedelta(step))
+        ends = starts + pd.to_timedelta(width)
+    starts = starts.to_numpy(dtype='datetime64[ns]')
+    ends = ends.to_numpy(dtype='datetime64[ns]')
+    
+    # Same rows as count_strategies: a left/right correct poke and a phase
+    events_frame = events_frame[events_frame['correct_poke'].notna() & events_frame['phase'].notna()]
+    phase_codes, phases = pd.factorize(events_frame['phase'])
+    # Slots 0-3 are the strategies, slot 4 collects every other event so empty phases can be told apart
+    strategy_lookup = np.append(pd.Index(STRATEGIES).get_indexer(COUNTED_EVENTS), -1)
+    slots = strategy_lookup[events_frame['event'].cat.codes.to_numpy()]
+    slots[slots < 0] = len(STRATEGIES)
+    n_slots = len(STRATEGIES) + 1
+    
+    # Sort the timestamps once by (phase, slot, time)
+    keys = phase_codes * n_slots + slots
+    times = events_frame['time'].to_numpy(dtype='datetime64[ns]')
+    order = np.lexsort((times, keys))
+    keys = keys[order]
+    times = times[order]
+    bounds = np.searchsorted(keys, np.arange(len(phases) * n_slots + 1))
+    
+    counts = np.zeros((len(starts), len(phases), n_slots), dtype=np.int64)
+    for key in range(len(phases) * n_slots):
+        key_times = times[bounds[key]:bounds[key + 1]]
+        if len(key_times):
+            counts[:, key // n_slots, key % n_slots] = (np.searchsorted(key_times, ends, side='right')
+                                                        - np.searchsorted(key_times, starts, side='left'))
+    
+    phase_order = sorted(range(len(phases)), key=lambda i: phase_sort_key(phases[i]))
+    counts = counts[:, phase_order, :]
+    window_index, phase_index = np.nonzero(counts.sum(axis=2))
+    strategy_counts = counts[window_index, phase_index, :len(STRATEGIES)]
+    strategy_totals = strategy_counts.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percentages = np.where(strategy_totals > 0, strategy_counts / strategy_totals * 100, 0.0)
+    
+    result = pd.DataFrame({
+        'window_start': starts[window_index],
+        'window_end': ends[window_index],
+        'phase': np.asarray(phases[phase_order], dtype=object)[phase_index],
+    })
+    for i, strategy in enumerate(STRATEGIES):
+        result[strategy] = strategy_counts[:, i]
+    for i, strategy in enumerate(STRATEGIES):
+        result[f'% {strategy}'] = percentages[:, i].round(1)
+    return result
+
+def resolve_session_layout(columns):
+    """Read plan of a session header (see SESSION_LAYOUT). An events column headed 'H' is used
+    wherever it is, as in build_event_frame(); raises LayoutError when columns are missing."""
+    roles = list(SESSION_COLUMNS)
+    if 'H' in columns:
+        roles[1] = columns.index('H')
+    if max(roles) >= len(columns):
+        raise LayoutError(f"Expected at least {max(roles) + 1} columns (events in column H, "
+                          f"rule shift phase in column O), found {len(columns)}")
+    usecols = sorted(set(roles))
+    return {'usecols': usecols, 'order': [usecols.index(pos) for pos in roles],
+            'text_columns': [roles[-1]]}
+
+def read_layout(source, read_header, layouts):
+    """Fingerprint the header of source and return its cached or newly resolved read plan"""
+    columns = read_header(source).columns
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    # Unknown layouts are reported through stages, so --quiet silences them too
+    return layouts.resolve(columns, resolve_session_layout,
+                           log=lambda message: stages.log(message, file=sys.stderr))
+
+def read_csv_window(source, window=ANALYSIS_WINDOW, chunksize=100_000, layout=SESSION_LAYOUT):
+    """Stream a CSV session in chunks and stop reading once a chunk passes first event + window.
+    Only the columns of layout are read and put in SESSION_COLUMNS order, so the result uses
+    PROJECTED_COLUMNS positions. Assumes rows are in chronological order, as FED3 writes them."""
+    chunks = []
+    cutoff_time = None
+    # Read the rule shift phase as text, so phase 1 is the same label in every chunk
+    # whether or not that chunk also holds 'IA'
+    text_dtype = {pos: str for pos in layout['text_columns']}
+    with read_csv(source, usecols=layout['usecols'], dtype=text_dtype, chunksize=chunksize) as reader:
+        for chunk in reader:
+            time_col = chunk.columns[layout['order'][0]]
+            with stages.stage('timestamp parse', rows_in=len(chunk)) as counts:
+                chunk[time_col] = parse_timestamps(chunk[time_col])
+                counts['rows_out'] = len(chunk)
+            if cutoff_time is None:
+                cutoff_time = chunk[time_col].min() + window
+            with stages.stage('cutoff filter', rows_in=len(chunk)) as counts:
+                chunks.append(chunk[chunk[time_col] <= cutoff_time])
+                counts['rows_out'] = len(chunks[-1])
+            # Everything after this chunk is past the cutoff
+            if chunk[time_col].iloc[-1] > cutoff_time:
+                break
+    return pd.concat(chunks, ignore_index=True).iloc[:, layout['order']]
+
+def read_session_window(source, filename, window=ANALYSIS_WINDOW, layouts=None):
+    """Read only the analysis columns of a session, stopping early for CSVs once past the window.
+    The header is read first and its read plan looked up in layouts (default: session_layouts);
+    an unusable header raises LayoutError before the data is read.
+    Returns None for unsupported extensions; otherwise pass column_positions=PROJECTED_COLUMNS
+    to count_strategies()."""
+    layouts = layouts or session_layouts
+    kind = file_kind(filename)
+    if kind == 'excel':
+        layout = read_layout(source, lambda src: read_excel(src, nrows=0), layouts)
+        return read_excel(source, usecols=layout['usecols']).iloc[:, layout['order']]
+    if kind == 'csv':
+        # The loader sniffs the encoding, reading stray non-UTF-8 bytes as latin1
+        layout = read_layout(source, lambda src: read_csv(src, nrows=0), layouts)
+        return read_csv_window(source, window, layout=layout)
+    return None
+
+class SessionCache:
+    """On-disk cache of parsed session windows keyed by a hash of the file content.
+
+    Entries are Feather files when pyarrow is installed and pickles otherwise. Reading an
+    entry marks it as recently used; evict() drops the least recently used entries until
+    the cache fits in max_bytes.
+    """
+    # Bump when the cached frames change shape, so old entries are not reused
+    VERSION = 2
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.use_feather = importlib.util.find_spec('pyarrow') is not None
+
+    def key(self, path, window=ANALYSIS_WINDOW):
+        digest = hashlib.sha256(f"v{self.VERSION}|{SESSION_COLUMNS}|{window}|".encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def entries(self):
+        if not self.cache_dir.is_dir():
+            return []
+        return [p for p in self.cache_dir.iterdir() if p.suffix in ('.feather', '.pkl')]
+
+    def load(self, key):
+        for entry in (self.cache_dir / f"{key}.feather", self.cache_dir / f"{key}.pkl"):
+            try:
+                df = pd.read_feather(entry) if entry.suffix == '.feather' else pd.read_pickle(entry)
+            except (OSError, ImportError):
+                continue
+            entry.touch()  # Mark as recently used
+            return df
+        return None
+
+    def store(self, key, df):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Feather needs string column names, e.g. not the integer labels of a headerless file
+        use_feather = self.use_feather and all(isinstance(col, str) for col in df.columns)
+        # Write to a temporary file first so parallel workers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            suffix = '.pkl'
+            if use_feather:
+                try:
+                    df.to_feather(tmp_path)
+                    suffix = '.feather'
+                except (TypeError, ValueError, ImportError):
+                    # e.g. pyarrow.ArrowTypeError for an Excel phase column mixing 'IA' and numbers
+                    pass
+            if suffix == '.pkl':
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, self.cache_dir / f"{key}{suffix}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = sorted(self.entries(), key=lambda p: p.stat().st_mtime, reverse=True)
+        total = 0
+        for entry in entries:
+            total += entry.stat().st_size
+            if total > self.max_bytes:
+                entry.unlink()
+
+    def clear(self):
+        for entry in self.entries():
+            entry.unlink()
+
+def load_session(path, cache=None, layouts=None):
+    """Read the analysis window of a session file, going through the cache when one is given"""
+    name = Path(path).name
+    if cache is None:
+        return read_session_window(path, name, layouts=layouts)
+    key = cache.key(path)
+    df = cache.load(key)
+    if df is None:
+        df = read_session_window(path, name, layouts=layouts)
+        if df is not None:
+            cache.store(key, df)
+    return df
+
+def tidy_counts(filename, total_counts_df, phase_counts_pivot):
+    """Flatten the count tables of one file into file, phase, event, count rows.
+    Totals use 'TOTAL' as their phase; the % rows are left out since they follow from the counts."""
+    totals = pd.DataFrame({
+        'phase': 'TOTAL',
+        'event': total_counts_df.index,
+        'count': total_counts_df['FREQUENCY'].to_numpy(),
+    })
+    count_rows = [event for event in phase_counts_pivot.index if not event.startswith('%')]
+    phases = (phase_counts_pivot.loc[count_rows]
+              .rename_axis(index='event', columns='phase')
+              .stack()
+              .rename('count')
+              .reset_index()[['phase', 'event', 'count']])
+    tidy = pd.concat([totals, phases], ignore_index=True)
+    tidy['count'] = tidy['count'].astype(int)
+    tidy.insert(0, 'file', filename)
+    return tidy
+
+def process_session_file(path, cache=None, quiet=False, layouts=None):
+    """Batch worker: returns (tidy counts or None, error message or None, stage records) for one file.
+    Rows and records are labelled with the path as given, so same-named files from different
+    folders stay apart."""
+    stages.quiet = quiet
+    stages.context = path
+    stages.take_records()
+    tidy, error = None, None
+    try:
+        # Keep the per-step progress output of parallel workers off the console
+        with contextlib.redirect_stdout(io.StringIO()):
+            with stages.stage('read') as counts:
+                df = load_session(path, cache, layouts)
+                counts['rows_out'] = None if df is None else len(df)
+            if df is not None:
+                total_counts_df, phase_counts_pivot, _ = count_strategies(
+                    df, raise_errors=True, column_positions=PROJECTED_COLUMNS)
+        if df is None:
+            error = "Unsupported file format"
+        else:
+            for column, labels in total_counts_df.attrs['unknown_labels'].items():
+                if labels:
+                    stages.log(f"Unknown {column} labels in {path} (not counted): {labels}", file=sys.stderr)
+            tidy = tidy_counts(path, total_counts_df, phase_counts_pivot)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return tidy, error, stages.take_records()
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Count FED3 strategies for many session files in parallel.")
+    parser.add_argument("inputs", nargs="*", help="Session files, directories or glob patterns.")
+    parser.add_argument("--output", "-o", default="strategy_counts.csv",
+                        help="Combined tidy CSV with file, phase, event and count columns.")
+    parser.add_argument("--errors", "-e", default=None,
+                        help="Per-file error report CSV (default: <output>_errors.csv).")
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: one per core).")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR),
+                        help="Directory of the parsed-session cache.")
+    parser.add_argument("--cache-size-mb", type=int, default=DEFAULT_CACHE_MB,
+                        help="Size limit of the cache; least recently used entries are evicted past it.")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the parsed-session cache.")
+    parser.add_argument("--clear-cache", action="store_true", help="Empty the parsed-session cache first.")
+    parser.add_argument("--stage-log", default=None,
+                        help="Write per-file, per-stage timings as JSON lines to this file ('-' for stdout).")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Turn off all console output.")
+    args = parser.parse_args(argv)
+    stages.quiet = args.quiet
+
+    cache = SessionCache(args.cache_dir, args.cache_size_mb * 1024 * 1024)
+    layouts = LayoutCache(Path(args.cache_dir) / "layouts.json", kind=session_layouts.kind)
+    if args.clear_cache:
+        cache.clear()
+        layouts.clear()
+        stages.log(f"Cleared session cache: {args.cache_dir}")
+        if not args.inputs:
+            return 0
+    if args.no_cache:
+        cache = None
+        layouts = LayoutCache(None, kind=session_layouts.kind)
+
+    paths = collect_files(args.inputs, SESSION_EXTENSIONS)
+    if not paths:
+        stages.log("No session files found.", file=sys.stderr)
+        return 1
+
+    stages.log(f"Processing {len(paths)} files with {args.workers} workers...")
+    tables = []
+    errors = []
+    records = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        worker = partial(process_session_file, cache=cache, quiet=args.quiet, layouts=layouts)
+        for path, (tidy, error, file_records) in zip(paths, executor.map(worker, paths)):
+            records.extend(file_records)
+            if error is None:
+                tables.append(tidy)
+            else:
+                errors.append({'file': path, 'error': error})
+                stages.log(f"Error processing {path}: {error}", file=sys.stderr)
+    if cache is not None:
+        cache.evict()
+
+    stages.context = None
+    with stages.stage('write') as counts:
+        if tables:
+            combined = pd.concat(tables, ignore_index=True)
+        else:
+            combined = pd.DataFrame(columns=['file', 'phase', 'event', 'count'])
+        combined.to_csv(args.output, index=False)
+
+        errors_path = args.errors or str(Path(args.output).with_name(f"{Path(args.output).stem}_errors.csv"))
+        pd.DataFrame(errors, columns=['file', 'error']).to_csv(errors_path, index=False)
+        counts['rows_in'] = counts['rows_out'] = len(combined)
+    records.extend(stages.take_records())
+
+    if args.stage_log:
+        write_json_lines(records, args.stage_log)
+    stages.log("\nTime per stage:")
+    stages.log(summarize(records).to_string())
+
+    stages.log(f"Processed {len(tables)} of {len(paths)} files. Counts saved to: {args.output}")
+    stages.log(f"Error report saved to: {errors_path}")
+    return 0 if tables else 1
+
 def main():
+    # Colab-only imports, so the batch mode runs without Colab or IPython
+    from google.colab import files
+    from IPython.display import display
+
     while True:
         print("\nPlease upload your Excel (.xlsx, .xls) or CSV (.csv) file")
         print("(Upload a file with any other extension to exit)")
@@ -206,23 +650,15 @@ def main():
             break
         
         for filename in uploaded.keys():
-            # Convert filename to lowercase for case-insensitive comparison
-            file_lower = filename.lower()
             try:
-                if file_lower.endswith(('.xlsx', '.xls')):
-                    df = pd.read_excel(io.BytesIO(uploaded[filename]))
-                elif file_lower.endswith('.csv'):
-                    # Try different encoding options if needed
-                    try:
-                        df = pd.read_csv(io.BytesIO(uploaded[filename]))
-                    except UnicodeDecodeError:
-                        df = pd.read_csv(io.BytesIO(uploaded[filename]), encoding='latin1')
-                else:
+                df = read_session_window(io.BytesIO(uploaded[filename]), filename)
+                if df is None:
                     print(f"\nUnsupported file format for {filename}. Exiting...")
                     return  # Exit the program
                     
                 print(f"\nProcessing {filename}...")
-                total_counts_df, phase_counts_pivot, _ = count_strategies(df)
+                total_counts_df, phase_counts_pivot, _ = count_strategies(
+                    df, column_positions=PROJECTED_COLUMNS)
                 
                 if total_counts_df is not None:
                     print(f"\nResults for {filename}:")
@@ -258,4 +694,8 @@ def main():
         print("-----------------------------------")
 
 if __name__ == "__main__":
-    main()
+    # Interactive upload loop inside Colab, command-line batch mode everywhere else
+    if 'google.colab' in sys.modules:
+        main()
+    else:
+        sys.exit(batch_main())
@@ -4,22 +4,187 @@
 """
 Extract Columns Script
 
-This script allows users to upload a CSV or Excel file and extract specific columns.
+This script allows users to upload CSV or Excel files and extract specific columns.
 It will extract columns with headers "visits" and "duration" as well as columns at specific positions.
+Files are extracted one after another on a background thread, so more files can be queued
+while one is being processed.
+
+Run with files, directories or glob patterns to extract them without the window, in parallel:
+
+    python biobserve_extract_columns.py day1/ -o extracted/
+    python biobserve_extract_columns.py "day1/*.csv" --stack day1_extracted.csv
 """
 
+import argparse
 import os
+import queue
 import sys
+import tempfile
+import threading
+import time
 import pandas as pd
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
+from column_layouts import LayoutCache, LayoutError
+from data_loader import collect_files, file_kind, read_csv, read_table
+
+try:
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+except ImportError:
+    # Python builds without Tk can still run the command-line batch mode
+    tk = None
+
+# Specific columns to extract (1-based index)
+SPECIFIC_COLUMNS = [1, 2, 3, 4, 23, 26, 34, 37, 45, 48, 56, 59, 67, 70, 78, 81, 89, 92, 100, 103]
+
+# Headers to extract
+HEADERS_TO_EXTRACT = ["visits", "duration"]
+
+SUPPORTED_EXTENSIONS = ['.csv', '.xlsx', '.xls']
+
+# Rows under the header that hold the export's settings rather than data
+SKIP_ROWS = 12
+
+# Name prefix of the files the extraction writes
+OUTPUT_PREFIX = "extracted_"
+
+# Rows per chunk when reading and writing CSVs with progress reports
+CHUNK_ROWS = 10_000
+
+# Read plans per export header, so repeat files skip the header search
+column_layouts = LayoutCache(Path.home() / ".cache" / "biobserve_extract_columns" / "layouts.json",
+                             kind="biobserve_extract_columns")
+
+class ExtractionCancelled(Exception):
+    """Raised from a progress callback to stop an extraction"""
+
+def read_csv_with_progress(file_path, on_progress, **kwargs):
+    """Read a CSV in chunks, calling on_progress with the fraction of the file read so far"""
+    size = os.path.getsize(file_path) or 1
+    chunks = []
+    with open(file_path, 'rb') as f:
+        with read_csv(f, chunksize=CHUNK_ROWS, **kwargs) as reader:
+            for chunk in reader:
+                chunks.append(chunk)
+                on_progress(min(f.tell() / size, 1.0))
+    if not chunks:
+        return read_csv(file_path, nrows=0, **kwargs)
+    return pd.concat(chunks)
+
+def read_sheet(file_path, on_progress=None, **kwargs):
+    """Read a CSV or Excel file, passing kwargs (usecols, skiprows, nrows) to pandas.
+    CSVs are read in chunks when on_progress is given."""
+    if on_progress is not None and file_kind(file_path) == 'csv':
+        return read_csv_with_progress(file_path, on_progress, **kwargs)
+    return read_table(file_path, **kwargs)
+
+def write_sheet(df, save_path, on_progress=None):
+    """Save as CSV or Excel by extension. CSVs are written in chunks through a temporary file,
+    calling on_progress with the fraction written; a cancelled write leaves no partial file."""
+    save_ext = Path(save_path).suffix.lower()
+    if save_ext != '.csv':
+        df.to_excel(save_path, index=False)
+        return
+    # A temporary file of its own in the target folder, so parallel writers never share one
+    fd, tmp_path = tempfile.mkstemp(dir=Path(save_path).resolve().parent, prefix='.extracted_', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            df.iloc[:0].to_csv(f, index=False)
+            for start in range(0, len(df), CHUNK_ROWS):
+                df.iloc[start:start + CHUNK_ROWS].to_csv(f, header=False, index=False)
+                if on_progress is not None:
+                    on_progress(min((start + CHUNK_ROWS) / len(df), 1.0))
+        os.replace(tmp_path, save_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def resolve_columns(columns, positions, headers):
+    """
+    Return the names of the columns to extract, in output order: first the columns at
+    positions (0-based, in the order given), then any column whose header contains one
+    of headers. Duplicates are kept once.
+    """
+    selected = []
+    for pos in positions:
+        if pos < len(columns) and columns[pos] not in selected:
+            selected.append(columns[pos])
+    for header in headers:
+        for col in columns:
+            if header.lower() in str(col).lower() and col not in selected:
+                selected.append(col)
+    return selected
+
+def resolve_layout(columns, positions, headers, skip_rows=SKIP_ROWS):
+    """
+    Read plan of an export header: the positions to read (usecols, in file order) with their
+    names, the extracted columns in output order and the rows to skip.
+    Raises LayoutError when no column matches.
+    """
+    selected = resolve_columns(columns, positions, headers)
+    if not selected:
+        raise LayoutError("No matching columns found")
+    # pandas returns usecols in file order; the names are put back in output order after reading
+    index = {col: i for i, col in enumerate(columns)}
+    usecols = sorted(index[col] for col in selected)
+    return {'usecols': usecols, 'names': [columns[i] for i in usecols],
+            'selected': selected, 'skip_rows': skip_rows}
+
+def extract_from_file(file_path, positions, headers, skip_rows=SKIP_ROWS, on_progress=None, layouts=None):
+    """
+    Read only the resolved columns of a Biobserve export, without its first skip_rows data rows.
+
+    The header is scanned first on its own and its read plan looked up in layouts (default:
+    column_layouts), so the file is then parsed with usecols limited to the columns that are
+    extracted and the unused zone columns are never loaded.
+    Returns (extracted DataFrame or None when no column matches, whether rows were removed).
+    Files with skip_rows data rows or fewer are returned whole. on_progress, if given, is
+    called with the fraction of a CSV read so far.
+    """
+    layouts = layouts or column_layouts
+    columns = list(read_sheet(file_path, nrows=0).columns)
+    try:
+        layout = layouts.resolve(columns, lambda cols: resolve_layout(cols, positions, headers, skip_rows),
+                                 context=[positions, headers, skip_rows])
+    except LayoutError:
+        return None, False
+    
+    df = read_sheet(file_path, on_progress, usecols=layout['usecols'])
+    # The settings rows are dropped after parsing so they are counted like the data rows,
+    # without the blank lines the parser leaves out
+    rows_removed = len(df) > layout['skip_rows']
+    if rows_removed:
+        df = df.iloc[layout['skip_rows']:]
+    df.columns = layout['names']
+    return df[layout['selected']].reset_index(drop=True), rows_removed
+
+def output_path_for(file_path, output_dir=None):
+    """Default save path of a file's extracted columns: extracted_<name> in output_dir,
+    or next to the file"""
+    file_path = Path(file_path)
+    directory = Path(output_dir) if output_dir else file_path.parent
+    return str(directory / f"{OUTPUT_PREFIX}{file_path.stem}{file_path.suffix.lower()}")
+
+def is_own_output(path, stack=None):
+    """Whether path is a file this tool wrote: an extracted_<name> file or the stack file"""
+    path = Path(path)
+    if path.name.startswith(OUTPUT_PREFIX):
+        return True
+    return stack is not None and path.resolve() == Path(stack).resolve()
+
+
 class ColumnExtractorApp:
+    # Milliseconds between checks of the worker's message queue
+    POLL_MS = 100
+    
     def __init__(self, root):
         self.root = root
         self.root.title("Column Extractor")
-        self.root.geometry("600x400")
+        self.root.geometry("650x560")
         
         # Create main frame with padding
         self.main_frame = tk.Frame(self.root, padx=10, pady=10)
@@ -29,37 +194,69 @@ class ColumnExtractorApp:
         self.create_widgets()
         
         # Specific columns to extract (1-based index)
-        self.specific_columns = [1, 2, 3, 4, 23, 26, 34, 37, 45, 48, 56, 59, 67, 70, 78, 81, 89, 92, 100, 103]
+        self.specific_columns = SPECIFIC_COLUMNS
         # Convert to 0-based index for pandas
         self.specific_columns_0_based = [col-1 for col in self.specific_columns]
         
         # Headers to extract
-        self.headers_to_extract = ["visits", "duration"]
+        self.headers_to_extract = HEADERS_TO_EXTRACT
+        
+        # Listed files as [path, status]; status is None until the file is queued
+        self.entries = []
+        
+        # Files waiting for the worker, and messages from the worker back to the UI
+        self.pending = queue.Queue()
+        self.messages = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker = None
+        self.queued = 0
+        self.finished = 0
+        self.failed = 0
         
     def create_widgets(self):
         # File selection section
         file_frame = tk.LabelFrame(self.main_frame, text="File Selection", padx=10, pady=10)
         file_frame.pack(fill=tk.X, padx=5, pady=5)
         
-        self.file_path_var = tk.StringVar()
-        file_path_entry = tk.Entry(file_frame, textvariable=self.file_path_var, width=50)
-        file_path_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+        self.file_list = tk.Listbox(file_frame, height=6, width=50)
+        self.file_list.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         
-        browse_button = tk.Button(file_frame, text="Browse", command=self.browse_file)
-        browse_button.pack(side=tk.RIGHT, padx=5)
+        file_buttons = tk.Frame(file_frame)
+        file_buttons.pack(side=tk.RIGHT, padx=5)
+        browse_button = tk.Button(file_buttons, text="Browse", command=self.browse_file)
+        browse_button.pack(fill=tk.X)
+        clear_button = tk.Button(file_buttons, text="Clear Done", command=self.clear_done)
+        clear_button.pack(fill=tk.X, pady=(5, 0))
+        
+        # Output folder section; empty saves next to each input file
+        output_frame = tk.LabelFrame(self.main_frame, text="Output Folder (blank: same folder as each file)", padx=10, pady=10)
+        output_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        self.output_dir_var = tk.StringVar()
+        output_entry = tk.Entry(output_frame, textvariable=self.output_dir_var, width=50)
+        output_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+        
+        output_button = tk.Button(output_frame, text="Browse", command=self.browse_output_dir)
+        output_button.pack(side=tk.RIGHT, padx=5)
         
         # Status section
         status_frame = tk.Frame(self.main_frame, padx=10, pady=10)
         status_frame.pack(fill=tk.X, padx=5, pady=5)
         
         self.status_var = tk.StringVar(value="Ready to extract columns")
-        status_label = tk.Label(status_frame, textvariable=self.status_var)
-        status_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        status_label = tk.Label(status_frame, textvariable=self.status_var, anchor=tk.W)
+        status_label.pack(fill=tk.X, expand=True)
+        
+        self.progress = ttk.Progressbar(status_frame, mode='determinate', maximum=100)
+        self.progress.pack(fill=tk.X, expand=True, pady=(5, 0))
         
         # Action buttons
         button_frame = tk.Frame(self.main_frame, padx=10, pady=10)
         button_frame.pack(fill=tk.X, padx=5, pady=5)
         
+        self.cancel_button = tk.Button(button_frame, text="Cancel", command=self.cancel, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=5)
+        
         extract_button = tk.Button(button_frame, text="Extract Columns", command=self.extract_columns)
         extract_button.pack(side=tk.RIGHT, padx=5)
         
@@ -71,6 +268,7 @@ class ColumnExtractorApp:
         info_text += "1. Columns with headers 'visits' and 'duration'\n"
         info_text += "2. Columns at positions: 1, 2, 3, 4, 23, 26, 34, 37, 45, 48, 56, 59, 67, 70, 78, 81, 89, 92, 100, 103\n"
         info_text += "3. Will delete the first 12 rows of the sheet\n\n"
+        info_text += "Each file is saved as extracted_<name> in the output folder.\n"
         info_text += "Supported file formats: CSV and Excel (.xlsx, .xls)"
         
         info_label = tk.Label(info_frame, text=info_text, justify=tk.LEFT)
@@ -84,119 +282,295 @@ class ColumnExtractorApp:
             ("All files", "*.*")
         ]
         
-        file_path = filedialog.askopenfilename(
-            title="Select a CSV or Excel file",
+        file_paths = filedialog.askopenfilenames(
+            title="Select CSV or Excel files",
             filetypes=filetypes
         )
         
-        if file_path:
-            self.file_path_var.set(file_path)
-            self.status_var.set(f"Selected file: {Path(file_path).name}")
+        for file_path in file_paths:
+            self.entries.append([file_path, None])
+            self.file_list.insert(tk.END, file_path)
+        if file_paths:
+            self.status_var.set(f"Selected {len(file_paths)} file(s)")
+            # Files added while the worker is running join its queue right away
+            if self.worker is not None:
+                self.extract_columns()
+    
+    def browse_output_dir(self):
+        output_dir = filedialog.askdirectory(title="Select output folder")
+        if output_dir:
+            self.output_dir_var.set(output_dir)
+    
+    def clear_done(self):
+        # Remove the files that were already processed; rows keep their positions while
+        # the worker runs, so only clear when it is idle
+        if self.worker is not None:
+            self.status_var.set("Files can be cleared once the queue is finished")
+            return
+        for index in reversed(range(len(self.entries))):
+            if self.entries[index][1] is not None:
+                del self.entries[index]
+                self.file_list.delete(index)
+    
+    def set_file_status(self, index, text):
+        self.entries[index][1] = text
+        self.file_list.delete(index)
+        self.file_list.insert(index, f"{self.entries[index][0]} - {text}")
     
     def extract_columns(self):
-        file_path = self.file_path_var.get()
+        # Queue every listed file that has not been queued yet
+        new_files = [(index, file_path) for index, (file_path, status) in enumerate(self.entries)
+                     if status is None]
         
-        if not file_path:
-            messagebox.showerror("Error", "Please select a file first.")
+        if not new_files:
+            if self.worker is None:
+                messagebox.showerror("Error", "Please select a file first.")
             return
         
-        try:
-            # Update status
-            self.status_var.set("Reading file...")
-            self.root.update_idletasks()
-            
-            # Read the file based on extension
+        output_dir = self.output_dir_var.get().strip() or None
+        if output_dir and not os.path.isdir(output_dir):
+            messagebox.showerror("Error", f"Output folder does not exist: {output_dir}")
+            return
+        
+        for index, file_path in new_files:
             file_ext = Path(file_path).suffix.lower()
-            if file_ext == '.csv':
-                df = pd.read_csv(file_path)
-            elif file_ext in ['.xlsx', '.xls']:
-                df = pd.read_excel(file_path)
-            else:
-                messagebox.showerror("Error", "Unsupported file format. Please use CSV or Excel files.")
-                self.status_var.set("Error: Unsupported file format")
+            if file_ext not in SUPPORTED_EXTENSIONS:
+                self.set_file_status(index, "unsupported format")
+                continue
+            self.set_file_status(index, "queued")
+            self.pending.put((index, file_path, output_path_for(file_path, output_dir)))
+            self.queued += 1
+        
+        if self.worker is None and self.queued > self.finished:
+            self.cancel_event.clear()
+            self.start_worker()
+    
+    def start_worker(self):
+        self.cancel_button.config(state=tk.NORMAL)
+        self.worker = threading.Thread(target=self.run_worker, daemon=True)
+        self.worker.start()
+        self.root.after(self.POLL_MS, self.poll_messages)
+    
+    def cancel(self):
+        # Stop the current file and drop the queued ones
+        self.cancel_event.set()
+        self.status_var.set("Cancelling...")
+    
+    def run_worker(self):
+        # Runs on the worker thread: never touch Tk widgets here, only post messages
+        while True:
+            try:
+                index, file_path, save_path = self.pending.get_nowait()
+            except queue.Empty:
+                self.messages.put(('idle',))
                 return
-                
-            # Delete the first 12 rows as requested
-            if len(df) > 12:
-                df = df.iloc[12:].reset_index(drop=True)
-                self.status_var.set("Removed first 12 rows...")
-                self.root.update_idletasks()
-            else:
-                messagebox.showwarning("Warning", "The file has fewer than 12 rows. No rows were deleted.")
-            
-            # Extract columns by header
-            header_columns = []
-            for header in self.headers_to_extract:
-                matching_cols = [col for col in df.columns if header.lower() in col.lower()]
-                header_columns.extend(matching_cols)
-            
-            # Extract columns by position (ensure they exist)
-            position_columns = []
-            position_column_names = []
-            for pos in self.specific_columns_0_based:
-                if pos < len(df.columns):
-                    position_columns.append(pos)
-                    position_column_names.append(df.columns[pos])
-            
-            # Create a list to hold the final columns in the exact order we want
-            all_columns = []
-            
-            # First, add columns by position in the exact order specified
-            # This ensures the interval summary columns are at the far left
-            for pos in self.specific_columns_0_based:
-                if pos < len(df.columns):
-                    col_name = df.columns[pos]
-                    if col_name not in all_columns:  # Avoid duplicates
-                        all_columns.append(col_name)
-            
-            # Then add any header-based columns that weren't already included
-            for col in header_columns:
-                if col not in all_columns:  # Avoid duplicates
-                    all_columns.append(col)
+            if self.cancel_event.is_set():
+                self.messages.put(('cancelled', index))
+                continue
+            self.extract_one(index, file_path, save_path)
+    
+    def extract_one(self, index, file_path, save_path):
+        name = Path(file_path).name
+        
+        def report(start, end, text):
+            # Map a stage's own 0-1 progress onto the file's share of the bar
+            def on_progress(fraction):
+                if self.cancel_event.is_set():
+                    raise ExtractionCancelled()
+                self.messages.put(('progress', start + (end - start) * fraction, text))
+            return on_progress
+        
+        try:
+            report(0, 0, f"Reading {name}...")(0)
+            result_df, rows_removed = extract_from_file(
+                file_path, self.specific_columns_0_based, self.headers_to_extract,
+                on_progress=report(0, 70, f"Reading {name}..."))
             
             # Check if we found any columns
-            if not all_columns:
-                messagebox.showwarning("Warning", "No matching columns found in the file.")
-                self.status_var.set("No matching columns found")
-                return
-            
-            # Extract the columns while preserving order
-            result_df = df[all_columns]
-            
-            # Save the result
-            save_path = filedialog.asksaveasfilename(
-                title="Save extracted columns",
-                defaultextension=file_ext,
-                filetypes=[
-                    ("CSV file", "*.csv"),
-                    ("Excel file", "*.xlsx")
-                ],
-                initialdir=str(Path(file_path).parent),
-                initialfile=f"extracted_{Path(file_path).stem}{file_ext}"
-            )
-            
-            if not save_path:
-                self.status_var.set("Operation cancelled")
+            if result_df is None:
+                self.messages.put(('warning', index, "no matching columns",
+                                   f"No matching columns found in {name}."))
                 return
+            if not rows_removed:
+                self.messages.put(('warning', index, None,
+                                   f"{name} has fewer than 12 rows. No rows were deleted."))
             
-            # Save based on extension
-            save_ext = Path(save_path).suffix.lower()
-            if save_ext == '.csv':
-                result_df.to_csv(save_path, index=False)
-            else:
-                result_df.to_excel(save_path, index=False)
-            
-            self.status_var.set(f"Successfully extracted {len(all_columns)} columns to {Path(save_path).name}")
-            messagebox.showinfo("Success", f"Successfully extracted {len(all_columns)} columns and removed first 12 rows. Saved to {Path(save_path).name}")
-            
+            report(70, 70, f"Saving {Path(save_path).name}...")(0)
+            write_sheet(result_df, save_path, on_progress=report(70, 100, f"Saving {Path(save_path).name}..."))
+            self.messages.put(('done', index, len(result_df.columns), save_path))
+        except ExtractionCancelled:
+            self.messages.put(('cancelled', index))
         except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {str(e)}")
-            self.status_var.set(f"Error: {str(e)}")
+            self.messages.put(('error', index, str(e)))
+    
+    def poll_messages(self):
+        # Runs on the Tk main thread every POLL_MS while the worker is busy
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            kind = message[0]
+            if kind == 'progress':
+                _, value, text = message
+                self.progress['value'] = value
+                self.status_var.set(f"File {self.finished + 1} of {self.queued}: {text}")
+            elif kind == 'done':
+                _, index, n_columns, save_path = message
+                self.finished += 1
+                self.set_file_status(index, f"extracted {n_columns} columns to {Path(save_path).name}")
+            elif kind == 'warning':
+                _, index, status, text = message
+                if status is not None:
+                    self.finished += 1
+                    self.failed += 1
+                    self.set_file_status(index, status)
+                messagebox.showwarning("Warning", text)
+            elif kind == 'error':
+                _, index, error = message
+                self.finished += 1
+                self.failed += 1
+                self.set_file_status(index, f"error: {error}")
+                messagebox.showerror("Error", f"An error occurred: {error}")
+            elif kind == 'cancelled':
+                _, index = message
+                self.finished += 1
+                self.failed += 1
+                self.set_file_status(index, "cancelled")
+            elif kind == 'idle':
+                self.worker_finished()
+                return
+        self.root.after(self.POLL_MS, self.poll_messages)
+    
+    def worker_finished(self):
+        self.worker = None
+        # Files queued just as the worker ran out of work
+        if not self.pending.empty():
+            self.start_worker()
+            return
+        self.cancel_button.config(state=tk.DISABLED)
+        succeeded = self.finished - self.failed
+        if self.cancel_event.is_set():
+            self.progress['value'] = 0
+            self.status_var.set(f"Cancelled; extracted {succeeded} of {self.queued} files")
+        else:
+            self.progress['value'] = 100
+            self.status_var.set(f"Extracted {succeeded} of {self.queued} files")
+            if succeeded:
+                messagebox.showinfo("Success", f"Successfully extracted columns from {succeeded} file(s) and removed first 12 rows.")
+        self.queued = self.finished = self.failed = 0
+
+def extract_batch_file(file_path, output_dir=None, stacked=False):
+    """
+    Worker for the batch mode: extract one file and save it as extracted_<name> in
+    output_dir (or next to the input), or return it for stacking.
+    Returns (summary dict, extracted DataFrame when stacked).
+    """
+    start = time.perf_counter()
+    summary = {'file': file_path, 'rows': 0, 'columns': 0, 'bytes': 0,
+               'seconds': 0.0, 'output': None, 'warning': None, 'error': None}
+    df = None
+    try:
+        summary['bytes'] = os.path.getsize(file_path)
+        df, rows_removed = extract_from_file(
+            file_path, [col-1 for col in SPECIFIC_COLUMNS], HEADERS_TO_EXTRACT)
+        if df is None:
+            summary['error'] = "No matching columns found"
+        else:
+            if not rows_removed:
+                summary['warning'] = "fewer than 12 rows; no rows were deleted"
+            summary['rows'], summary['columns'] = df.shape
+            if not stacked:
+                summary['output'] = output_path_for(file_path, output_dir)
+                write_sheet(df, summary['output'])
+                df = None
+    except Exception as e:
+        summary['error'] = str(e)
+        df = None
+    summary['seconds'] = time.perf_counter() - start
+    return summary, df
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract the Biobserve columns from many CSV/Excel files in parallel.")
+    parser.add_argument("inputs", nargs="+", help="Files, directories or glob patterns.")
+    parser.add_argument("--output-dir", "-o", default=None,
+                        help="Folder for the extracted_<name> files (default: next to each input).")
+    parser.add_argument("--stack", "-s", default=None,
+                        help="Write all files into this one CSV/Excel file, with a source_file column, "
+                             "instead of one output per input.")
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: one per core).")
+    args = parser.parse_args(argv)
+
+    # Outputs of earlier runs saved next to the inputs are not extracted again
+    paths = collect_files(args.inputs, SUPPORTED_EXTENSIONS,
+                          exclude=lambda path: is_own_output(path, args.stack))
+    if not paths:
+        print("No CSV or Excel files found.", file=sys.stderr)
+        return 1
+    if args.stack is None:
+        # Inputs with the same name in different folders would overwrite each other's output
+        outputs = [output_path_for(p, args.output_dir) for p in paths]
+        clashes = sorted({Path(out).name for out in outputs if outputs.count(out) > 1})
+        if clashes:
+            print(f"Several inputs would be saved as {', '.join(clashes)}; "
+                  f"extract them to separate folders.", file=sys.stderr)
+            return 1
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    workers = max(1, min(args.workers or 1, len(paths)))
+    print(f"Extracting {len(paths)} files with {workers} workers...")
+    start = time.perf_counter()
+    summaries = []
+    stacked = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        worker = partial(extract_batch_file, output_dir=args.output_dir, stacked=args.stack is not None)
+        # Results come back in input order, so the stacked file is ordered the same way
+        for summary, df in executor.map(worker, paths):
+            summaries.append(summary)
+            # The path as given, so files of the same name in different folders stay apart
+            path = summary['file']
+            if summary['error']:
+                print(f"Error processing {path}: {summary['error']}", file=sys.stderr)
+                continue
+            if summary['warning']:
+                print(f"Warning for {path}: {summary['warning']}", file=sys.stderr)
+            if df is not None:
+                df.insert(0, 'source_file', path)
+                stacked.append(df)
+
+    if args.stack and stacked:
+        write_sheet(pd.concat(stacked, ignore_index=True), args.stack)
+        print(f"Stacked {len(stacked)} files into: {args.stack}")
+    elapsed = time.perf_counter() - start
+
+    # Summary of throughput and failures
+    report = pd.DataFrame(summaries)
+    failed = report[report['error'].notna()]
+    succeeded = report[report['error'].isna()]
+    megabytes = report['bytes'].sum() / 1e6
+    print(f"\nExtracted {len(succeeded)} of {len(report)} files "
+          f"({succeeded['rows'].sum()} rows, {megabytes:.1f} MB read) in {elapsed:.2f} s: "
+          f"{len(report) / elapsed:.1f} files/s, {megabytes / elapsed:.1f} MB/s")
+    if len(failed):
+        print(f"{len(failed)} failed:")
+        for _, row in failed.iterrows():
+            print(f"  {row['file']}: {row['error']}")
+    return 1 if len(failed) else 0
 
 def main():
+    if tk is None:
+        print("tkinter is not available; pass files to run the command-line batch mode.", file=sys.stderr)
+        return 1
     root = tk.Tk()
     app = ColumnExtractorApp(root)
     root.mainloop()
+    return 0
 
 if __name__ == "__main__":
-    main()
+    # With arguments, run the batch mode without opening a window
+    if len(sys.argv) > 1:
+        sys.exit(batch_main())
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#shared column layout cache for the spreadsheet scripts (count_strategies.py, biobserve_extract_columns.py)
+"""
+Resolved column layouts, cached per header fingerprint.
+
+Files from one device or software version share the same header row. A LayoutCache hashes
+the header (the fingerprint) and stores the plan a script resolved for it, such as the
+column positions to read, their dtypes and the rows to skip, in a small JSON file. Later
+files with the same header reuse the plan for a projected read without searching the header
+again. A header the script cannot handle is recorded too: it is reported once and later
+files with it fail right after the header is read, instead of deep in processing.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+class LayoutError(ValueError):
+    """The header does not have the columns a script needs"""
+
+def log_to_stderr(message):
+    print(message, file=sys.stderr)
+
+def header_fingerprint(columns, kind, version=1, context=None):
+    """Hash of the header names, namespaced by the script (kind), its resolver version and
+    any settings the plan depends on (context, JSON-serializable)"""
+    names = json.dumps([str(col) for col in columns])
+    return hashlib.sha256(f"{kind}|v{version}|{json.dumps(context)}|{names}".encode()).hexdigest()
+
+class LayoutCache:
+    """Plans resolved by one script, keyed by header fingerprint and kept in a JSON file.
+
+    resolve(columns, resolver) returns the cached plan for the header, or calls
+    resolver(columns) for a new header and stores the plan it returns; a resolver raises
+    LayoutError for headers it cannot handle. Pass the settings the resolver uses as context
+    so plans made with other settings are kept apart. Unknown layouts are reported once
+    through log (default: stderr), e.g. a script's quiet-aware logger. Plans must be
+    JSON-serializable. With path None the plans are only kept in memory. Bump version when a resolver changes, so
+    plans made by the old one are not reused.
+    """
+
+    def __init__(self, path, kind, version=1):
+        self.path = Path(path) if path is not None else None
+        self.kind = kind
+        self.version = version
+        self.plans = None
+        self.reported = set()
+
+    def load(self):
+        if self.plans is None:
+            self.plans = {}
+            if self.path is not None:
+                try:
+                    with open(self.path) as f:
+                        self.plans = json.load(f)
+                except (OSError, ValueError):
+                    pass
+        return self.plans
+
+    def save(self):
+        if self.path is None:
+            return
+        # Merge with entries other processes wrote meanwhile, then replace the file atomically
+        try:
+            with open(self.path) as f:
+                plans = json.load(f)
+        except (OSError, ValueError):
+            plans = {}
+        plans.update(self.plans)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix='.layouts_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(plans, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # The cache only saves work; a failed write must not fail the analysis
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def resolve(self, columns, resolver, context=None, log=log_to_stderr):
+        fingerprint = header_fingerprint(columns, self.kind, self.version, context)
+        plans = self.load()
+        entry = plans.get(fingerprint)
+        if entry is None:
+            try:
+                entry = {'plan': resolver(list(columns))}
+            except LayoutError as e:
+                entry = {'error': str(e)}
+            plans[fingerprint] = entry
+            self.save()
+        if 'error' in entry:
+            if fingerprint not in self.reported:
+                self.reported.add(fingerprint)
+                log(f"Unknown column layout {fingerprint[:12]}: {entry['error']}")
+            raise LayoutError(entry['error'])
+        return entry['plan']
+
+    def clear(self):
+        self.plans = {}
+        if self.path is not None and self.path.exists():
+            self.path.unlink()
@@ -0,0 +1,199 @@
+#shared file loading for the data scripts (count_strategies.py, fed_extract_columns.py, biobserve_extract_columns.py, fed_pellet_graph.py)
+"""
+One place to load the CSV and Excel data files.
+
+read_table() picks the reader by extension: workbooks go through excel_reader.read_excel()
+(calamine engine and converted files), CSVs through read_csv(). read_csv() is pd.read_csv with:
+
+- the encoding and delimiter sniffed from the first SNIFF_BYTES of the file, unless given.
+  UTF-8 files are decoded with a fallback that reads any stray non-UTF-8 byte as latin1,
+  so a file with a few latin1 characters loads without starting over; files whose prefix has
+  bytes that are not UTF-8 and no UTF-8 characters are read as latin1. Delimiters tried are
+  comma, semicolon and tab.
+- the pyarrow engine when pyarrow is installed and the read can use it: a whole-file read
+  with only simple options and one dtype for every column, so values come out as the C
+  engine would give them. Otherwise, and if pyarrow fails, the C engine.
+- memory mapping for files of MEMORY_MAP_BYTES or more read by the C engine.
+- column projections passed straight through as usecols.
+
+Paths and open binary files (e.g. uploads in Colab) are both accepted. to_float() converts a
+whole column to floats, with NaN for cells that are not numbers. collect_files() expands the
+files, directories and glob patterns given to the batch modes.
+"""
+
+import codecs
+import csv
+import glob
+import importlib.util
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    from excel_reader import read_excel
+except ImportError:
+    # Imported as maze.data_loader (count_strategies.py) rather than from a maze script
+    from maze.excel_reader import read_excel
+
+CSV_EXTENSIONS = ('.csv',)
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+# Bytes read to sniff the encoding and delimiter
+SNIFF_BYTES = 64 * 1024
+# Delimiters tried, preferred first
+DELIMITERS = (',', ';', '\t')
+# CSVs at least this large are memory-mapped by the C engine
+MEMORY_MAP_BYTES = 64 * 1024 * 1024
+# read_csv() arguments the pyarrow engine handles the same way as the C engine
+PYARROW_ARGUMENTS = {'usecols', 'header', 'names', 'dtype', 'encoding', 'sep', 'keep_default_na', 'na_values'}
+
+# A multi-byte UTF-8 character
+UTF8_CHARACTER = re.compile(rb'[\xc2-\xdf][\x80-\xbf]|[\xe0-\xef][\x80-\xbf]{2}|[\xf0-\xf4][\x80-\xbf]{3}')
+
+# Decode invalid UTF-8 bytes as latin1 instead of failing the read
+codecs.register_error('latin1_fallback', lambda e: (e.object[e.start:e.end].decode('latin1'), e.end))
+
+def file_kind(name):
+    """'csv' or 'excel' by file extension, else None"""
+    suffix = Path(str(name)).suffix.lower()
+    if suffix in CSV_EXTENSIONS:
+        return 'csv'
+    if suffix in EXCEL_EXTENSIONS:
+        return 'excel'
+    return None
+
+def read_prefix(source, size=SNIFF_BYTES):
+    # First bytes of a path or an open binary file, leaving the file where it was
+    if hasattr(source, 'read'):
+        position = source.tell()
+        prefix = source.read(size)
+        source.seek(position)
+        return prefix if isinstance(prefix, bytes) else None
+    with open(source, 'rb') as f:
+        return f.read(size)
+
+def detect_encoding(prefix):
+    """'utf-8-sig' for a UTF-8 byte order mark, 'latin1' when the prefix has bytes that are
+    not UTF-8 and no UTF-8 characters, else 'utf-8'"""
+    if prefix.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        prefix.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A character cut off at the end of the prefix is still UTF-8, and a UTF-8 file with
+        # a few latin1 bytes is read by the fallback
+        if e.reason != 'unexpected end of data' and not UTF8_CHARACTER.search(prefix):
+            return 'latin1'
+    return 'utf-8'
+
+def detect_delimiter(text):
+    """The first of DELIMITERS that splits every sampled line into the same number (> 1) of
+    fields; failing that, the one giving the most fields on a typical line"""
+    lines = [line for line in text.splitlines()[:20] if line.strip()]
+    if not lines:
+        return DELIMITERS[0]
+    typical = {}
+    for delimiter in DELIMITERS:
+        counts = [len(row) for row in csv.reader(lines, delimiter=delimiter)]
+        if min(counts) > 1 and min(counts) == max(counts):
+            return delimiter
+        typical[delimiter] = np.median(counts)
+    return max(DELIMITERS, key=lambda delimiter: typical[delimiter])
+
+def sniff_csv(source):
+    """(encoding, delimiter) of a CSV path or open binary file from its first SNIFF_BYTES"""
+    prefix = read_prefix(source)
+    if not prefix:
+        return 'utf-8', DELIMITERS[0]
+    encoding = detect_encoding(prefix)
+    text = prefix.decode(encoding, errors='replace')
+    if len(prefix) == SNIFF_BYTES:
+        # Leave out the last line, which may be cut off
+        text = text[:text.rfind('\n') + 1] or text
+    return encoding, detect_delimiter(text)
+
+def file_size(source):
+    try:
+        return os.path.getsize(source)
+    except (OSError, TypeError, ValueError):
+        return None
+
+def can_use_pyarrow(source, kwargs):
+    if importlib.util.find_spec('pyarrow') is None or not set(kwargs) <= PYARROW_ARGUMENTS:
+        return False
+    if not isinstance(source, (str, os.PathLike)):
+        return False
+    # The C engine handles these decodings; pyarrow only reads UTF-8
+    if kwargs.get('encoding') not in ('utf-8', 'utf-8-sig'):
+        return False
+    # pyarrow infers its own types (e.g. ISO timestamps); with one dtype for every column it
+    # has nothing to infer
+    return kwargs.get('dtype') is not None and not isinstance(kwargs['dtype'], dict)
+
+def read_csv(source, **kwargs):
+    """pd.read_csv with a sniffed encoding and delimiter, the fastest engine for the read and
+    memory mapping of large files. Returns a reader when chunksize is given, like pandas."""
+    has_delimiter = kwargs.get('sep', kwargs.get('delimiter')) is not None
+    if kwargs.get('encoding') is None or not has_delimiter:
+        encoding, delimiter = sniff_csv(source)
+        if kwargs.get('encoding') is None:
+            kwargs['encoding'] = encoding
+            if encoding != 'latin1':
+                kwargs.setdefault('encoding_errors', 'latin1_fallback')
+        if not has_delimiter:
+            kwargs.pop('delimiter', None)
+            kwargs['sep'] = delimiter
+
+    # pyarrow decodes strictly; undecodable files fall through to the C engine below
+    arrow_kwargs = {k: v for k, v in kwargs.items() if k != 'encoding_errors'}
+    if can_use_pyarrow(source, arrow_kwargs):
+        try:
+            return pd.read_csv(source, engine='pyarrow', **arrow_kwargs)
+        except (ValueError, TypeError, UnicodeDecodeError):
+            # e.g. pyarrow.ArrowInvalid for undecodable bytes or ragged rows; the C engine
+            # handles those or raises the usual pandas error
+            pass
+
+    size = file_size(source)
+    if size is not None and size >= MEMORY_MAP_BYTES:
+        kwargs.setdefault('memory_map', True)
+    return pd.read_csv(source, **kwargs)
+
+def read_table(source, name=None, **kwargs):
+    """Read a CSV or Excel file (by the extension of name, default source), passing kwargs
+    such as usecols, skiprows and nrows to the reader"""
+    kind = file_kind(name if name is not None else source)
+    if kind == 'csv':
+        return read_csv(source, **kwargs)
+    if kind == 'excel':
+        return read_excel(source, **kwargs)
+    raise ValueError("Unsupported file format. Please use CSV or Excel files.")
+
+def collect_files(inputs, extensions=CSV_EXTENSIONS + EXCEL_EXTENSIONS, exclude=None):
+    """Expand directories (files with one of extensions) and glob patterns into a sorted,
+    de-duplicated list of paths. Paths for which exclude(path) is true (e.g. a tool's own
+    outputs) are left out of directories and patterns; files named explicitly are kept."""
+    paths = []
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = [str(p) for p in Path(item).iterdir() if p.suffix.lower() in extensions]
+        else:
+            matches = glob.glob(item)
+        if exclude is not None and (os.path.isdir(item) or glob.has_magic(item)):
+            matches = [match for match in matches if not exclude(match)]
+        for match in sorted(matches):
+            if match not in seen:
+                seen.add(match)
+                paths.append(match)
+    return paths
+
+def to_float(column):
+    """A whole column as a float array; cells that are not numbers become NaN"""
+    # Columns the CSV parser already typed as numbers need no conversion
+    if not pd.api.types.is_numeric_dtype(column):
+        column = pd.to_numeric(column, errors='coerce')
+    return np.asarray(column, dtype=float)
@@ -0,0 +1,149 @@
+#shared Excel reading for the spreadsheet scripts (count_strategies.py, biobserve_extract_columns.py)
+"""
+Faster Excel reads.
+
+read_excel() is a drop-in for pd.read_excel. It uses the calamine engine when
+python-calamine is installed (pandas 2.2+), which is several times faster than the default
+openpyxl engine on large workbooks; otherwise pandas' read-only openpyxl path is used.
+
+A workbook can also be converted once to a columnar file next to it (book.xlsx.parquet with
+pyarrow installed, book.xlsx.pkl otherwise). While the converted file is newer than the
+workbook, read_excel() loads it instead and applies usecols, skiprows and nrows itself, so
+the same DataFrame comes out either way:
+
+    python excel_reader.py day1/*.xlsx
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# read_excel() arguments that can be applied to a converted workbook
+CONVERTED_ARGUMENTS = {'usecols', 'skiprows', 'nrows'}
+
+def excel_engine():
+    """'calamine' when python-calamine is installed, else None (pandas' default, openpyxl for .xlsx)"""
+    if importlib.util.find_spec('python_calamine') is not None:
+        return 'calamine'
+    return None
+
+def converted_paths(path):
+    """Columnar files a workbook may have been converted to, preferred first"""
+    return [Path(f"{path}.parquet"), Path(f"{path}.pkl")]
+
+def fresh_conversion(path):
+    """The converted file of a workbook when it is newer than the workbook, else None"""
+    try:
+        workbook_mtime = os.stat(path).st_mtime_ns
+    except (OSError, TypeError, ValueError):
+        return None
+    for converted in converted_paths(path):
+        try:
+            if converted.stat().st_mtime_ns >= workbook_mtime:
+                return converted
+        except OSError:
+            continue
+    return None
+
+def log_to_stderr(message):
+    print(message, file=sys.stderr)
+
+def convert_workbook(path, log=log_to_stderr):
+    """Read the first sheet of a workbook once and save it next to it as Parquet (with pyarrow)
+    or as a pickle. Returns the path written. A fallback to the pickle is reported through log."""
+    df = pd.read_excel(path, engine=excel_engine())
+    parquet_path, pickle_path = converted_paths(path)
+    # Parquet needs string column names and one type per column
+    if importlib.util.find_spec('pyarrow') is not None and all(isinstance(col, str) for col in df.columns):
+        try:
+            df.to_parquet(parquet_path, index=False)
+            if pickle_path.exists():
+                pickle_path.unlink()
+            return parquet_path
+        except (TypeError, ValueError, ImportError) as e:
+            # e.g. pyarrow.ArrowTypeError for columns mixing text and numbers
+            if parquet_path.exists():
+                parquet_path.unlink()
+            log(f"Saving {Path(path).name} as a pickle instead of Parquet: {e}")
+    df.to_pickle(pickle_path)
+    if parquet_path.exists():
+        parquet_path.unlink()
+    return pickle_path
+
+def select_converted(df, usecols=None, skiprows=None, nrows=None):
+    """Apply read_excel's usecols (positions), skiprows (file rows; 0 is the header) and nrows
+    to a whole converted sheet"""
+    if usecols is not None:
+        # pandas returns the columns in sheet order
+        df = df.iloc[:, sorted(usecols)]
+    if skiprows is not None:
+        data_rows = np.asarray([row - 1 for row in skiprows], dtype=np.int64)
+        df = df.iloc[np.setdiff1d(np.arange(len(df)), data_rows)]
+    if nrows is not None:
+        df = df.iloc[:nrows]
+    # Columns typed by rows that were dropped (e.g. text settings rows) get the type pandas
+    # would infer from the rows that are left
+    df = df.reset_index(drop=True).infer_objects()
+    if df.empty:
+        # As in pandas, columns without rows have no type
+        return df.astype(object)
+    return df.apply(retype)
+
+def retype(column):
+    """Type a text column like pandas' parser: numbers when every value is numeric"""
+    if not (pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column)):
+        return column
+    try:
+        return pd.to_numeric(column)
+    except (TypeError, ValueError):
+        return column
+
+def can_use_converted(kwargs):
+    if not set(kwargs) <= CONVERTED_ARGUMENTS:
+        return False
+    usecols, skiprows = kwargs.get('usecols'), kwargs.get('skiprows')
+    if usecols is not None and not all(isinstance(col, (int, np.integer)) for col in usecols):
+        return False
+    # Skipping the header row itself changes which row becomes the header
+    return skiprows is None or (not callable(skiprows) and 0 not in skiprows)
+
+def read_excel(source, **kwargs):
+    """pd.read_excel through a fresh converted file when there is one, else the fastest engine"""
+    if isinstance(source, (str, os.PathLike)) and can_use_converted(kwargs):
+        converted = fresh_conversion(source)
+        if converted is not None:
+            if converted.suffix == '.parquet':
+                df = pd.read_parquet(converted)
+            else:
+                df = pd.read_pickle(converted)
+            return select_converted(df, **kwargs)
+    return pd.read_excel(source, engine=excel_engine(), **kwargs)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert Excel workbooks once to columnar files that later reads load instead.")
+    parser.add_argument("workbooks", nargs="+", help="Workbooks (.xlsx, .xls) to convert.")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Turn off all console output.")
+    args = parser.parse_args(argv)
+
+    def log(message, file=sys.stdout):
+        if not args.quiet:
+            print(message, file=file)
+
+    failed = 0
+    for path in args.workbooks:
+        try:
+            converted = convert_workbook(path, log=lambda message: log(message, file=sys.stderr))
+            log(f"Converted {path} -> {converted.name}")
+        except Exception as e:
+            failed += 1
+            log(f"Error converting {path}: {e}", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,44 @@
 #this is a script to feed multiple FED device files for the maze dispenser code
 #upload all FED files for each mouse, and it will create a masterfile with time elapsed, sort it into pellet retrieval time and pellet count columns for easy analysis and comparison
+#run it without arguments to pick files in a dialog, or pass the FED files to run it headless:
+#    python fed_extract_columns.py mouse1.csv mouse2.csv -o masterfile.csv
+#add --update to splice only new or changed files into an existing masterfile, or --watch to follow
+#logs that a session is still writing and keep the masterfile up to date as they grow
+import argparse
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import sys
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-import tkinter as tk
-from tkinter import filedialog
 from datetime import datetime, timedelta
 
-def seconds_to_hhmmss(seconds):
-    return str(timedelta(seconds=int(seconds)))
+from data_loader import read_csv
+from fed_follow import FileFollower, Throttle
+from fed_stages import StageRecorder, summarize
+from fed_time import format_hms, parse_hms, parse_timestamps
+
+# Timestamp, pellet count (column R) and retrieval time (column T) by position
+SOURCE_COLUMNS = [0, 17, 19]
+
+# Only rows strictly before 40 minutes are kept
+CUTOFF = timedelta(minutes=40)
+
+# Bump when the manifest layout changes, so old manifests trigger a full rebuild
+MANIFEST_VERSION = 1
+
+# Per-stage timings of each batch, printed after it is saved
+stages = StageRecorder()
 
 def select_files():
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()  # Hide the main window
     file_paths = filedialog.askopenfilenames(
@@ -20,6 +48,8 @@ def select_files():
     return list(file_paths)
 
 def save_file():
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()  # Hide the main window
     file_path = filedialog.asksaveasfilename(
@@ -30,97 +60,449 @@ def save_file():
     )
     return file_path if file_path else None
 
+def read_fed_window(file_path, chunksize=100_000):
+    # Read only SOURCE_COLUMNS in chunks and stop once a chunk passes first timestamp + CUTOFF
+    # Assumes rows are in chronological order, as the FED devices write them
+    chunks = []
+    first_timestamp = cutoff_time = None
+    with read_csv(file_path, usecols=SOURCE_COLUMNS, chunksize=chunksize) as reader:
+        while True:
+            with stages.stage('read') as counts:
+                chunk = next(reader, None)
+                counts['rows_out'] = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                break
+            
+            # Convert timestamps to datetime
+            timestamp_col = chunk.columns[0]
+            with stages.stage('timestamp parse', rows_in=len(chunk)) as counts:
+                chunk[timestamp_col] = parse_timestamps(chunk[timestamp_col])
+                counts['rows_out'] = len(chunk)
+            if cutoff_time is None:
+                first_timestamp = chunk[timestamp_col].min()
+                cutoff_time = first_timestamp + CUTOFF
+            
+            with stages.stage('cutoff filter', rows_in=len(chunk)) as counts:
+                chunks.append(chunk[chunk[timestamp_col] < cutoff_time])
+                counts['rows_out'] = len(chunks[-1])
+            # Everything after this chunk is past the cutoff
+            if len(chunk) and chunk[timestamp_col].iloc[-1] >= cutoff_time:
+                break
+    df = pd.concat(chunks, ignore_index=True)
+    return df, first_timestamp
+
 def process_csv(file_path):
-    # Read the CSV file
-    df = pd.read_csv(file_path)
+    stages.context = Path(file_path).name
     
-    # Assuming timestamp is in the first column
-    timestamp_col = df.columns[0]
+    # Read the timestamp, pellet count and retrieval time of the first 40 minutes
+    df, first_timestamp = read_fed_window(file_path)
     
-    # Convert timestamps to datetime
-    df[timestamp_col] = pd.to_datetime(df[timestamp_col])
+    with stages.stage('column normalization', rows_in=len(df)) as counts:
+        df = normalize_columns(df, first_timestamp, Path(file_path).stem)
+        counts['rows_out'] = len(df)
     
-    # Calculate time elapsed in seconds from the first timestamp
-    first_timestamp = df[timestamp_col].min()
-    seconds_elapsed = (df[timestamp_col] - first_timestamp).dt.total_seconds()
+    return df
 
-    # Filter to keep only rows strictly before 40 minutes (2400 seconds)
-    mask_lt_40min = seconds_elapsed < (40 * 60)
-    df = df[mask_lt_40min].copy()
-    seconds_elapsed = seconds_elapsed[mask_lt_40min]
+def normalize_columns(df, first_timestamp, source_name):
+    # Keep whole seconds as integers; they are formatted as HH:MM:SS only when writing
+    seconds_elapsed = (df.iloc[:, 0] - first_timestamp).dt.total_seconds()
+    return pd.DataFrame({
+        'seconds_elapsed': seconds_elapsed.astype(int),
+        f'{source_name}_pellet_count': df.iloc[:, 1],  # Column R
+        f'{source_name}_retrieval_time': df.iloc[:, 2],  # Column T
+    })
+
+class LiveFile:
+    # Running first-40-minutes series of one FED log that is still being written.
+    # Each update parses only the rows appended since the last one.
     
-    # Convert seconds to HH:MM:SS format
-    df['time_elapsed'] = seconds_elapsed.apply(seconds_to_hhmmss)
+    def __init__(self, file_path):
+        self.follower = FileFollower(file_path)
+        self.source_name = Path(file_path).stem
+        self.reset()
     
-    # Extract pellet_count (column R) and retrieval_time (column T)
-    # Convert column indices: R is 17th column (0-based index 16), T is 19th column (0-based index 18)
-    source_name = Path(file_path).stem
-    df[f'{source_name}_pellet_count'] = df.iloc[:, 17]  # Column R
-    df[f'{source_name}_retrieval_time'] = df.iloc[:, 19]  # Column T
+    def reset(self):
+        self.header = None
+        self.first_timestamp = None
+        self.frames = []
+        self.done = False  # past the 40-minute cutoff; later rows are not needed
     
-    # Keep only the new columns
-    df = df[['time_elapsed', f'{source_name}_pellet_count', f'{source_name}_retrieval_time']]
+    def update(self):
+        # Returns the number of rows added to the series
+        lines = self.follower.read_lines()
+        if self.follower.restarted:
+            self.reset()
+        if self.header is None and lines:
+            self.header = lines.pop(0)
+        if self.done or not lines:
+            return 0
+        
+        chunk = pd.read_csv(io.StringIO('\n'.join([self.header] + lines)), usecols=SOURCE_COLUMNS,
+                            sep=self.follower.delimiter)
+        timestamp_col = chunk.columns[0]
+        chunk[timestamp_col] = parse_timestamps(chunk[timestamp_col])
+        if self.first_timestamp is None:
+            self.first_timestamp = chunk[timestamp_col].min()
+        cutoff_time = self.first_timestamp + CUTOFF
+        if chunk[timestamp_col].iloc[-1] >= cutoff_time:
+            self.done = True
+        chunk = chunk[chunk[timestamp_col] < cutoff_time]
+        self.frames.append(normalize_columns(chunk, self.first_timestamp, self.source_name))
+        return len(chunk)
     
-    return df
+    def frame(self):
+        if not self.frames:
+            return pd.DataFrame(columns=['seconds_elapsed', f'{self.source_name}_pellet_count',
+                                         f'{self.source_name}_retrieval_time'])
+        if len(self.frames) > 1:
+            self.frames = [pd.concat(self.frames, ignore_index=True)]
+        return self.frames[0]
+
+def watch_files(file_paths, output_path, keep_seconds=False, poll=1.0, refresh=5.0):
+    # Follow growing FED logs and rewrite the masterfile at most every `refresh` seconds
+    # while new rows arrive. Stops once every file is past the 40-minute cutoff, or on Ctrl+C.
+    live_files = [LiveFile(file_path) for file_path in file_paths]
+    throttle = Throttle(refresh)
+    pending_rows = 0
+    stages.log(f"Watching {len(live_files)} files; press Ctrl+C to stop.")
+    try:
+        while True:
+            for live in live_files:
+                try:
+                    pending_rows += live.update()
+                except Exception as e:
+                    stages.log(f"Error reading {live.follower.path}: {str(e)}")
+            finished = all(live.done for live in live_files)
+            
+            if pending_rows and (finished or throttle.ready()):
+                combined_df = merge_dataframes([live.frame() for live in live_files])
+                output_df = format_elapsed(combined_df, keep_seconds=keep_seconds)
+                atomic_write(output_path, lambda path: output_df.to_csv(path, index=False))
+                stages.log(f"{time.strftime('%H:%M:%S')} Updated {output_path}: "
+                           f"{len(combined_df)} rows (+{pending_rows} new)")
+                pending_rows = 0
+            if finished:
+                stages.log("All files are past the 40-minute cutoff.")
+                return
+            time.sleep(poll)
+    except KeyboardInterrupt:
+        stages.log("\nStopped watching.")
+
+def process_file(file_path, quiet=False):
+    # Pool worker: returns (processed frame, error message, stage records) for one file
+    stages.quiet = quiet
+    # Drop records a forked worker inherited from the parent process
+    stages.take_records()
+    try:
+        df, error = process_csv(file_path), None
+    except Exception as e:
+        df, error = None, str(e)
+    return df, error, stages.take_records()
+
+def process_files(file_paths, workers=None):
+    # Process the files concurrently; results keep the order of file_paths so the
+    # masterfile columns come out in the same order on every run
+    processed_dfs = []
+    records = []
+    workers = max(1, min(workers or os.cpu_count() or 1, len(file_paths)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        worker = partial(process_file, quiet=stages.quiet)
+        for file_path, (df, error, file_records) in zip(file_paths, executor.map(worker, file_paths)):
+            records.extend(file_records)
+            if error is None:
+                processed_dfs.append(df)
+                stages.log(f"Successfully processed {Path(file_path).name}")
+            else:
+                stages.log(f"Error processing {Path(file_path).name}: {error}")
+    return processed_dfs, records
 
 def merge_dataframes(dfs):
-    # Create a list to store all unique time_elapsed values
-    all_times = []
+    # Align all files on their integer seconds in one pass, instead of merging each
+    # file into a growing master frame
+    # Rows that share a second within a file are paired with the other files in order,
+    # so every row is keyed by (second, occurrence within that second)
+    keys = []
     for df in dfs:
-        all_times.extend(df['time_elapsed'].tolist())
+        seconds = df['seconds_elapsed']
+        occurrence = seconds.groupby(seconds).cumcount()
+        keys.append((seconds.to_numpy(dtype=np.int64), occurrence.to_numpy(dtype=np.int64)))
+    width = max((occurrence.max() + 1 for _, occurrence in keys if len(occurrence)), default=1)
+    encoded = [seconds * width + occurrence for seconds, occurrence in keys]
     
-    # Remove duplicates and sort
-    unique_times = sorted(list(set(all_times)))
+    # Sorted union of the keys of every file
+    all_keys = np.unique(np.concatenate(encoded)) if encoded else np.array([], dtype=np.int64)
+    all_rows = pd.RangeIndex(len(all_keys))
     
-    # Create a new dataframe with the time_elapsed column
-    merged_df = pd.DataFrame({'time_elapsed': unique_times})
+    # Place each file's columns at the positions of its keys; missing rows become NaN
+    columns = {'seconds_elapsed': pd.Series(all_keys // width, index=all_rows)}
+    for df, file_keys in zip(dfs, encoded):
+        positions = np.searchsorted(all_keys, file_keys)
+        for col in df.columns:
+            if col != 'seconds_elapsed':
+                columns[col] = pd.Series(df[col].to_numpy(), index=positions).reindex(all_rows)
     
-    # For each source dataframe, merge its data
-    for df in dfs:
-        # Get the source-specific column names (they'll be like 'sourcename_pellet_count')
-        source_cols = [col for col in df.columns if col != 'time_elapsed']
-        
-        # Merge with the main dataframe
-        merged_df = merged_df.merge(df[['time_elapsed'] + source_cols], 
-                                  on='time_elapsed', 
-                                  how='left')
+    return pd.DataFrame(columns)
+
+def format_elapsed(df, keep_seconds=False):
+    # Replace the integer seconds_elapsed column with an H:MM:SS time_elapsed column,
+    # or keep the integer seconds as they are when keep_seconds is set
+    if keep_seconds:
+        return df
+    df = df.copy()
+    df.insert(0, 'time_elapsed', format_hms(df.pop('seconds_elapsed'), pad_hours=False))
+    return df
+
+def merge_files(file_paths, workers=None):
+    # Process and merge one batch; returns (masterfile frame or None, stage records)
+    processed_dfs, records = process_files(file_paths, workers)
+    if not processed_dfs:
+        return None, records
+    
+    # Merge all dataframes with the new format
+    stages.context = None
+    with stages.stage('merge', rows_in=sum(len(df) for df in processed_dfs)) as counts:
+        combined_df = merge_dataframes(processed_dfs)
+        counts['rows_out'] = len(combined_df)
+    return combined_df, records
+
+def manifest_path(output_path):
+    # Sidecar of the masterfile listing its source files, e.g. masterfile.csv.manifest.json
+    return Path(f"{output_path}.manifest.json")
+
+def file_signature(file_path):
+    # Size, modification time and content hash of a source file
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+def source_key(file_path):
+    return str(Path(file_path).resolve())
+
+def stem_clashes(file_paths):
+    # Names shared by different files (e.g. a/mouse1.csv and b/mouse1.csv); their
+    # <name>_pellet_count and <name>_retrieval_time columns would overwrite each other
+    stems = {}
+    for file_path in file_paths:
+        stems.setdefault(Path(file_path).stem, set()).add(source_key(file_path))
+    return sorted(stem for stem, keys in stems.items() if len(keys) > 1)
+
+def report_clashes(file_paths):
+    # Log the clashing names and return True when there are any
+    clashes = stem_clashes(file_paths)
+    if clashes:
+        stages.log(f"Several files are named {', '.join(clashes)}; their masterfile columns would "
+                   f"overwrite each other. Rename them or combine them in separate batches.", file=sys.stderr)
+    return bool(clashes)
+
+def source_signatures(file_paths, combined_df):
+    # Manifest entries of the files whose columns made it into the masterfile
+    sources = {}
+    for file_path in file_paths:
+        if f'{Path(file_path).stem}_pellet_count' in combined_df.columns:
+            sources[source_key(file_path)] = file_signature(file_path)
+    return sources
+
+def load_manifest(output_path):
+    # Source entries of an existing masterfile, or None when there is no usable manifest
+    try:
+        with open(manifest_path(output_path)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION or not Path(output_path).exists():
+        return None
+    return manifest['files']
+
+def atomic_write(output_path, write):
+    # Write through a temporary file in the same directory so a crash never leaves half a file
+    directory = Path(output_path).resolve().parent
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.fed_extract_', suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_manifest(output_path, sources):
+    manifest = {'version': MANIFEST_VERSION, 'files': sources}
+    atomic_write(manifest_path(output_path),
+                 lambda path: Path(path).write_text(json.dumps(manifest, indent=2)))
+
+def write_masterfile(combined_df, output_path, records, keep_seconds=False, sources=None):
+    # sources: manifest entries to record next to the masterfile for later --update runs
+    stages.context = None
+    with stages.stage('write', rows_in=len(combined_df)):
+        output_df = format_elapsed(combined_df, keep_seconds=keep_seconds)
+        atomic_write(output_path, lambda path: output_df.to_csv(path, index=False))
+        if sources is not None:
+            write_manifest(output_path, sources)
+    stages.log(f"\nProcessed data saved to: {output_path}")
+    stages.log("\nTime per stage:")
+    stages.log(summarize(records + stages.take_records()).to_string())
+
+def pending_files(file_paths, sources):
+    # Files that are new or whose content changed since the masterfile was written.
+    # Files whose size and mtime are unchanged are skipped without reading them; files that
+    # were only touched keep their columns and get their manifest entry refreshed.
+    pending = []
+    for file_path in file_paths:
+        entry = sources.get(source_key(file_path))
+        if entry is not None:
+            stat = os.stat(file_path)
+            if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+                continue
+            signature = file_signature(file_path)
+            if signature['sha256'] == entry['sha256']:
+                sources[source_key(file_path)] = signature
+                continue
+        pending.append(file_path)
+    return pending
+
+def read_masterfile(output_path):
+    # Read a masterfile with its data columns as text, so the columns that are not replaced
+    # are written back exactly as they were. Returns (frame with integer seconds_elapsed,
+    # whether the file stores integer seconds)
+    master = read_csv(output_path, dtype=str, keep_default_na=False)
+    time_col = master.columns[0]
+    if time_col == 'seconds_elapsed':
+        seconds = master[time_col].astype(np.int64)
+    else:
+        seconds = parse_hms(master[time_col]).astype(np.int64)
+    master = master.drop(columns=time_col)
+    master.insert(0, 'seconds_elapsed', seconds)
+    return master, time_col == 'seconds_elapsed'
+
+def update_masterfile(pending, output_path, sources, workers=None):
+    # Splice the columns of the new or changed files into an existing masterfile.
+    # Returns (masterfile frame, stage records, whether it stores integer seconds); the
+    # frame is None when none of the files could be processed
+    processed_dfs, records = process_files(pending, workers)
+    if not processed_dfs:
+        return None, records, None
     
-    return merged_df
+    stages.context = None
+    with stages.stage('masterfile read') as counts:
+        master, keep_seconds = read_masterfile(output_path)
+        counts['rows_out'] = len(master)
+    
+    with stages.stage('merge', rows_in=len(master) + sum(len(df) for df in processed_dfs)) as counts:
+        # Columns of changed files are replaced in place; new files are appended
+        new_columns = [col for df in processed_dfs for col in df.columns if col != 'seconds_elapsed']
+        column_order = list(master.columns) + [col for col in new_columns if col not in master.columns]
+        replaced = [col for col in new_columns if col in master.columns]
+        if replaced:
+            master = master.drop(columns=replaced)
+            # Drop the rows that only the replaced files had
+            data_columns = master.columns.drop('seconds_elapsed')
+            master = master[(master[data_columns] != '').any(axis=1)]
+        combined_df = merge_dataframes([master] + processed_dfs)[column_order]
+        counts['rows_out'] = len(combined_df)
+    
+    sources.update(source_signatures(pending, combined_df))
+    return combined_df, records, keep_seconds
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Combine FED device files into a masterfile of pellet counts and retrieval times.")
+    parser.add_argument("files", nargs="*",
+                        help="FED CSV files to combine, in column order. Without files, pick them in a dialog.")
+    parser.add_argument("--output", "-o", default="masterfile.csv",
+                        help="Masterfile to write when files are given (default: masterfile.csv).")
+    parser.add_argument("--workers", "-j", type=int, default=None,
+                        help="Number of worker processes (default: one per core).")
+    parser.add_argument("--seconds", action="store_true",
+                        help="Write time elapsed as integer seconds (seconds_elapsed) instead of H:MM:SS.")
+    parser.add_argument("--update", "-u", action="store_true",
+                        help="Update the existing masterfile given by --output, processing only the files "
+                             "that are new or changed since it was written.")
+    parser.add_argument("--watch", "-w", action="store_true",
+                        help="Follow files that are still being written and rewrite --output as they grow.")
+    parser.add_argument("--poll", type=float, default=1.0,
+                        help="Seconds between checks for new rows in --watch mode (default: 1).")
+    parser.add_argument("--refresh", type=float, default=5.0,
+                        help="Minimum seconds between masterfile rewrites in --watch mode (default: 5).")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Turn off all console output.")
+    args = parser.parse_args(argv)
+    stages.quiet = args.quiet
+    
+    if args.watch:
+        if not args.files:
+            parser.error("--watch needs the FED files to follow")
+        if report_clashes(args.files):
+            return 1
+        watch_files(args.files, args.output, keep_seconds=args.seconds, poll=args.poll, refresh=args.refresh)
+        return 0
+    
+    # Headless: one batch from the command line
+    if args.files:
+        if report_clashes(args.files):
+            return 1
+        sources = load_manifest(args.output) if args.update else None
+        # Files already in the masterfile count too: a new file of the same name would
+        # replace their columns
+        if sources is not None and report_clashes(args.files + list(sources)):
+            return 1
+        if sources is not None:
+            stages.context = None
+            with stages.stage('change check', rows_in=len(args.files)) as counts:
+                pending = pending_files(args.files, sources)
+                counts['rows_out'] = len(pending)
+            if not pending:
+                # Still record the refreshed mtimes of files that were only touched
+                write_manifest(args.output, sources)
+                stages.take_records()
+                stages.log("Masterfile is up to date; no new or changed files.")
+                return 0
+            
+            stages.log(f"Updating {len(pending)} of {len(args.files)} files...")
+            combined_df, records, keep_seconds = update_masterfile(pending, args.output, sources, args.workers)
+            if combined_df is None:
+                stages.log("No files were successfully processed.", file=sys.stderr)
+                return 1
+            # The masterfile keeps the time format it was written with
+            write_masterfile(combined_df, args.output, records, keep_seconds=keep_seconds, sources=sources)
+            return 0
+        if args.update:
+            stages.log(f"No manifest found for {args.output}; building the masterfile from all files.")
+        
+        combined_df, records = merge_files(args.files, args.workers)
+        if combined_df is None:
+            stages.log("No files were successfully processed.", file=sys.stderr)
+            return 1
+        write_masterfile(combined_df, args.output, records, keep_seconds=args.seconds,
+                         sources=source_signatures(args.files, combined_df))
+        return 0
+    
     while True:
         # Select CSV files
-        print("\n--- New Batch Processing ---")
+        stages.log("\n--- New Batch Processing ---")
         file_paths = select_files()
         if not file_paths:
-            print("No files selected. Exiting.")
-            return
-        
-        # Process each file and store in a list
-        processed_dfs = []
-        for file_path in file_paths:
-            try:
-                df = process_csv(file_path)
-                processed_dfs.append(df)
-                print(f"Successfully processed {Path(file_path).name}")
-            except Exception as e:
-                print(f"Error processing {Path(file_path).name}: {str(e)}")
-        
-        if not processed_dfs:
-            print("No files were successfully processed. Please try again.")
+            stages.log("No files selected. Exiting.")
+            return 0
+        if report_clashes(file_paths):
             continue
         
-        # Merge all dataframes with the new format
-        combined_df = merge_dataframes(processed_dfs)
+        # Process each file and merge them
+        combined_df, records = merge_files(file_paths, args.workers)
+        if combined_df is None:
+            stages.log("No files were successfully processed. Please try again.")
+            continue
         
         # Let user choose where to save the file
         output_path = save_file()
         if output_path:
-            combined_df.to_csv(output_path, index=False)
-            print(f"\nProcessed data saved to: {output_path}")
-            print("\nReady for next batch of files...")
+            write_masterfile(combined_df, output_path, records, keep_seconds=args.seconds,
+                             sources=source_signatures(file_paths, combined_df))
+            stages.log("\nReady for next batch of files...")
         else:
-            print("\nSave cancelled. Ready for next batch of files...")
+            stages.take_records()
+            stages.log("\nSave cancelled. Ready for next batch of files...")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#shared tail-following helpers for the FED scripts (fed_extract_columns.py, fed_pellet_graph.py)
+"""
+Follow FED device logs while a session is still writing them.
+
+A FileFollower remembers how far into a file it has read (a byte offset) and returns only the
+complete lines appended since the last call, so each update costs the size of the new data
+rather than the whole file. The encoding and delimiter are sniffed by data_loader when the
+file is first read (and again after a restart), as the batch modes do, so callers parse the
+lines with follower.delimiter. A Throttle limits how often the callers rewrite the
+masterfile or redraw the plot.
+"""
+
+import os
+import time
+
+class FileFollower:
+    """Reads the lines appended to a growing text file since the last call.
+
+    A trailing line without its newline is held back until the device finishes writing it.
+    If the file shrinks (the device started a new log), reading starts over from the top
+    and restarted is set until the next call. encoding and delimiter are sniffed from the
+    start of the file unless given.
+    """
+
+    def __init__(self, path, encoding=None, delimiter=None):
+        self.path = path
+        self.given = (encoding, delimiter)
+        self.encoding = encoding or 'utf-8'
+        self.delimiter = delimiter or ','
+        self.errors = 'replace'
+        self.offset = 0
+        self.partial = b''
+        self.restarted = False
+
+    def sniff(self):
+        # data_loader brings in pandas, so it is only imported once there is a file to read
+        try:
+            from data_loader import sniff_csv
+        except ImportError:
+            from maze.data_loader import sniff_csv
+        encoding, delimiter = sniff_csv(self.path)
+        self.encoding = self.given[0] or encoding
+        self.delimiter = self.given[1] or delimiter
+        # Stray latin1 bytes in a UTF-8 log are read as latin1, as in the batch modes
+        self.errors = 'strict' if self.encoding == 'latin1' else 'latin1_fallback'
+
+    def read_lines(self):
+        """Return the complete lines appended since the last call, without line endings.
+        The first call returns the file from the top, header included."""
+        self.restarted = False
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            # Not created yet
+            return []
+        if size < self.offset:
+            self.offset, self.partial = 0, b''
+            self.restarted = True
+        if size == self.offset:
+            return []
+        if self.offset == 0 and None in self.given:
+            self.sniff()
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset += len(data)
+
+        data = self.partial + data
+        end = data.rfind(b'\n') + 1
+        self.partial = data[end:]
+        text = data[:end].decode(self.encoding, errors=self.errors)
+        return [line.rstrip('\r') for line in text.split('\n')[:-1] if line.strip()]
+
+class Throttle:
+    """True at most once every `interval` seconds"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = None
+
+    def ready(self):
+        now = time.monotonic()
+        if self.last is None or now - self.last >= self.interval:
+            self.last = now
+            return True
+        return False
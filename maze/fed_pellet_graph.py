@@ -1,13 +1,29 @@
 #!/usr/bin/env python3
+from __future__ import annotations
+
 import argparse
 import csv
+import fnmatch
 import math
 import sys
-from typing import List, Tuple, Optional
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Tuple, Optional
 
 import os
 
-import matplotlib.pyplot as plt
+from fed_follow import FileFollower, Throttle
+
+# numpy, pandas and the modules built on them are imported in the functions that use them,
+# so --help and argument errors return without loading them
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# Default value columns (0-based positions) and their series names
+DEFAULT_SERIES = {1: "Day 1", 3: "Day 2"}
 
 # Use Tk only when we need to open a dialog (avoids GUI init in CLI-only usage)
 def pick_file_with_dialog() -> Optional[str]:
@@ -26,36 +42,18 @@ def pick_file_with_dialog() -> Optional[str]:
     root.destroy()
     return path or None
 
-def seconds_to_hms(seconds: float) -> str:
-    total = int(max(0, round(seconds)))
-    h = total // 3600
-    m = (total % 3600) // 60
-    s = total % 60
-    return f"{h:02d}:{m:02d}:{s:02d}"
-
-def to_hms(value: str) -> str:
-    s = (value or "").strip()
-    if not s:
-        return ""
-    # If it's already time-like (has ':') assume it's hh:mm:ss
-    if ":" in s:
-        parts = s.split(":")
-        try:
-            parts = [int(float(p)) for p in parts]
-            while len(parts) < 3:
-                parts.insert(0, 0)  # pad to hh:mm:ss
-            h, m, sec = parts[-3], parts[-2], parts[-1]
-            # Normalize minutes/seconds if out of range
-            total = max(0, h) * 3600 + max(0, m) * 60 + max(0, sec)
-            return seconds_to_hms(total)
-        except Exception:
-            # Keep as-is if parsing fails
-            return s
-    # Otherwise attempt seconds -> hh:mm:ss
-    try:
-        return seconds_to_hms(float(s))
-    except Exception:
-        return s
+def to_hms(values: List[str]) -> List[str]:
+    """
+    Format time values as "hh:mm:ss" labels, all at once.
+    Values that are already time-like (have ':') are read as hh:mm:ss, others as seconds;
+    values that cannot be parsed are kept as-is.
+    """
+    import numpy as np
+    from fed_time import format_hms, parse_hms
+    text = [(v or "").strip() for v in values]
+    seconds = parse_hms(text)
+    labels = format_hms(seconds)
+    return np.where(np.isfinite(seconds), labels, np.array(text, dtype=object)).tolist()
 
 def try_float(s: str) -> Optional[float]:
     try:
@@ -69,27 +67,15 @@ def looks_like_header(row: List[str]) -> bool:
         return False
     return try_float(row[1]) is None and try_float(row[3]) is None
 
-def process_csv(path: str) -> Tuple[List[str], List[float], List[float]]:
+def parse_rows(rows: List[List[str]]) -> Tuple[List[str], List[float], List[float]]:
     """
-    Returns: (labels_hms, day1_values, day2_values)
-    - labels_hms: formatted "hh:mm:ss" strings from column 1
-    - day1_values: floats from column 2
-    - day2_values: floats from column 4
-    Skips empty/invalid rows.
+    Returns (labels_hms, day1_values, day2_values) for the valid rows; rows that are too
+    short or have no number in columns 2 and 4 are skipped.
     """
-    labels: List[str] = []
+    times: List[str] = []
     day1: List[float] = []
     day2: List[float] = []
-
-    with open(path, newline="") as f:
-        reader = csv.reader(f)
-        rows = [r for r in reader if r and any(c.strip() for c in r)]
-
-    if not rows:
-        raise ValueError("The CSV appears to be empty.")
-
-    start = 1 if looks_like_header(rows[0]) else 0
-    for r in rows[start:]:
+    for r in rows:
         if len(r) < 4:
             continue
         t_raw = r[0]
@@ -97,39 +83,162 @@ def process_csv(path: str) -> Tuple[List[str], List[float], List[float]]:
         d2 = try_float(r[3])
         if t_raw is None or d1 is None or d2 is None:
             continue
-        labels.append(to_hms(str(t_raw)))
+        times.append(str(t_raw))
         day1.append(d1)
         day2.append(d2)
+    return to_hms(times), day1, day2
 
-    if not labels:
+def select_columns(path: str, pattern: str) -> Tuple[List[int], List[str]]:
+    # Positions and names of the value columns whose header matches the pattern
+    # (shell-style, e.g. "*_pellet_count"); the first column is always the time
+    from data_loader import read_csv
+    header = read_csv(path, nrows=0).columns
+    positions = [i for i, name in enumerate(header) if i > 0 and fnmatch.fnmatchcase(str(name), pattern)]
+    if not positions:
+        raise ValueError(f"No columns match {pattern!r}. Columns: {', '.join(map(str, header))}")
+    return positions, [str(header[i]) for i in positions]
+
+def process_csv(path: str, pattern: Optional[str] = None,
+                chunksize: int = 100_000) -> Tuple[List[str], List[str], np.ndarray]:
+    """
+    Returns: (labels_hms, names, values)
+    - labels_hms: formatted "hh:mm:ss" strings from column 1
+    - names: series names, "Day 1" and "Day 2" by default, else the matching column headers
+    - values: floats, one row per series; by default from columns 2 and 4
+    Skips empty/invalid rows: by default rows need a number in columns 2 and 4; with a
+    pattern (masterfiles, where each column only has values at its own device's readings)
+    rows need a number in any matching column, and missing cells are NaN.
+    The file is read in chunks of only the needed columns and each chunk is checked as a
+    whole; a header row (see looks_like_header) fails the number check like other invalid rows.
+    """
+    import numpy as np
+    import pandas as pd
+    from data_loader import read_csv, to_float
+    times, values = [], []
+    try:
+        if pattern:
+            positions, names = select_columns(path, pattern)
+        else:
+            positions, names = list(DEFAULT_SERIES), list(DEFAULT_SERIES.values())
+        with read_csv(path, header=None, usecols=[0] + positions, dtype={0: str},
+                         skiprows=1 if pattern else None, chunksize=chunksize) as reader:
+            for chunk in reader:
+                chunk_values = np.column_stack([to_float(chunk[p]) for p in positions])
+                present = ~np.isnan(chunk_values)
+                valid = present.any(axis=1) if pattern else present.all(axis=1)
+                times.append(chunk[0].fillna("").to_numpy(dtype=object)[valid])
+                values.append(chunk_values[valid])
+    except pd.errors.EmptyDataError:
+        raise ValueError("The CSV appears to be empty.")
+
+    if not times or not sum(len(t) for t in times):
+        if pattern:
+            raise ValueError(f"No valid data rows found. Ensure the columns matching {pattern!r} contain numbers.")
         raise ValueError("No valid data rows found. Ensure columns 2 and 4 contain numbers.")
 
-    return labels, day1, day2
+    return to_hms(np.concatenate(times).tolist()), names, np.ascontiguousarray(np.concatenate(values).T)
+
+def peak_indices(values: np.ndarray) -> np.ndarray:
+    # Position of each series' maximum, ignoring missing values (0 for an empty series)
+    import numpy as np
+    if values.shape[-1] == 0:
+        # e.g. a watched log that has only its header so far
+        return np.zeros(values.shape[:-1], dtype=np.intp)
+    return np.argmax(np.where(np.isnan(values), -np.inf, values), axis=-1)
 
-def annotate_max(ax, x_positions: List[int], y_values: List[float], color: str):
-    if not y_values:
+def fill_gaps(values: np.ndarray) -> np.ndarray:
+    # Carry each series' last reading forward over missing values, so sparse masterfile
+    # columns draw as continuous lines; values before the first reading stay missing
+    import numpy as np
+    positions = np.where(np.isnan(values), 0, np.arange(values.shape[-1]))
+    return np.take_along_axis(values, np.maximum.accumulate(positions, axis=-1), axis=-1)
+
+def series_stats(labels: List[str], names: List[str], values: np.ndarray) -> pd.DataFrame:
+    """Readings, peak, time of the peak and last value of every series, computed for all at once"""
+    import numpy as np
+    import pandas as pd
+    if values.shape[1] == 0:
+        peak_values = last = np.full(len(values), np.nan)
+        peak_times = ""
+    else:
+        peaks = peak_indices(values)
+        peak_values = np.take_along_axis(values, peaks[:, None], axis=1)[:, 0]
+        peak_times = np.where(np.isnan(peak_values), "", np.asarray(labels, dtype=object)[peaks])
+        last = fill_gaps(values)[:, -1]
+    return pd.DataFrame({
+        "series": names,
+        "readings": np.count_nonzero(~np.isnan(values), axis=1),
+        "peak": peak_values,
+        "peak_time": peak_times,
+        "last": last,
+    })
+
+def downsample_indices(values: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of a shape-preserving subset of at most about max_points points of each series
+    (one row of indices per row of values, in order): every series is cut into
+    max_points // 2 equal buckets and the lowest and highest point of each bucket are kept,
+    plus the first and last point and the overall maximum that annotate_peaks() labels.
+    """
+    import numpy as np
+    count, n = values.shape
+    if n <= max_points:
+        return np.broadcast_to(np.arange(n), (count, n))
+    buckets = max(1, max_points // 2)
+    size = math.ceil(n / buckets)
+    # Pad to whole buckets; padding never wins a min or max
+    padded = np.full((count, buckets * size), np.nan)
+    padded[:, :n] = values
+    padded = padded.reshape(count, buckets, size)
+    offsets = np.arange(buckets) * size
+    lows = offsets + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=2)
+    highs = offsets + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=2)
+    ends = np.broadcast_to([0, n - 1], (count, 2))
+    keep = np.concatenate([ends, peak_indices(values)[:, None], lows, highs], axis=1)
+    return np.sort(np.minimum(keep, n - 1), axis=1)
+
+def max_plot_points(ax) -> int:
+    # Two points (a low and a high) per horizontal pixel of the axes, at least 2000
+    return 2 * max(int(ax.get_window_extent().width), 1000)
+
+def series_colors(count: int) -> List:
+    # Red and blue for the usual two days; a qualitative colormap for more series
+    if count <= 2:
+        return ["red", "blue"][:count]
+    from matplotlib import colormaps
+    cmap = colormaps["tab10" if count <= 10 else "tab20"]
+    return [cmap(i % cmap.N) for i in range(count)]
+
+def annotate_peaks(ax, values: np.ndarray, colors: List):
+    import numpy as np
+    if values.shape[-1] == 0:
+        return
+    peaks = peak_indices(values)
+    peak_values = np.take_along_axis(values, peaks[:, None], axis=1)[:, 0]
+    found = np.flatnonzero(~np.isnan(peak_values))
+    if not len(found):
         return
-    max_idx = max(range(len(y_values)), key=lambda i: y_values[i])
-    max_val = y_values[max_idx]
-    x = x_positions[max_idx]
-    y = max_val
-    ax.scatter([x], [y], color=color, s=40, zorder=3)
-    # Slight vertical offset for the label
-    ax.annotate(f"{max_val:g}", xy=(x, y), xytext=(0, 8),
-                textcoords="offset points", ha="center", va="bottom",
-                color=color, fontsize=9,
-                bbox=dict(boxstyle="round,pad=0.2", fc="white", ec=color, lw=0.5))
-
-def plot_graph(labels: List[str], day1: List[float], day2: List[float], title: str):
+    ax.scatter(peaks[found], peak_values[found], color=[colors[i] for i in found], s=40, zorder=3)
+    for i in found:
+        # Slight vertical offset for the label
+        ax.annotate(f"{peak_values[i]:g}", xy=(peaks[i], peak_values[i]), xytext=(0, 8),
+                    textcoords="offset points", ha="center", va="bottom",
+                    color=colors[i], fontsize=9,
+                    bbox=dict(boxstyle="round,pad=0.2", fc="white", ec=colors[i], lw=0.5))
+
+def draw_graph(ax, labels: List[str], names: List[str], values: np.ndarray, title: str):
+    import numpy as np
     # Use categorical x-axis positions
     x = list(range(len(labels)))
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    colors = series_colors(len(names))
 
-    plt.figure(figsize=(10, 5))
-    ax = plt.gca()
-
-    # Plot lines
-    ax.plot(x, day1, color="red", label="Day 1", linewidth=2)
-    ax.plot(x, day2, color="blue", label="Day 2", linewidth=2)
+    # Plot all lines in one call, each downsampled to the axes' pixel width so large series
+    # draw in bounded time
+    filled = fill_gaps(values)
+    keep = downsample_indices(filled, max_plot_points(ax))
+    ax.set_prop_cycle(color=colors)
+    ax.plot(keep.T, np.take_along_axis(filled, keep, axis=1).T, label=names, linewidth=2)
 
     # Axis labels and title
     ax.set_xlabel("time elapsed (hh:mm:ss)")
@@ -151,20 +260,201 @@ def plot_graph(labels: List[str], day1: List[float], day2: List[float], title: s
     ax.set_xticklabels(tick_labels, rotation=45, ha="right")
 
     # Annotate maxima
-    annotate_max(ax, x, day1, color="red")
-    annotate_max(ax, x, day2, color="blue")
+    annotate_peaks(ax, values, colors)
 
-    ax.legend(loc="best")
+    ax.legend(loc="best", fontsize="small" if len(names) > 10 else None, ncol=math.ceil(len(names) / 15))
     ax.grid(True, linestyle="--", alpha=0.3)
 
+def plot_graph(labels: List[str], names: List[str], values: np.ndarray, title: str):
+    # pyplot (and its GUI backend) is only loaded when a window is shown
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(10, 5))
+    draw_graph(plt.gca(), labels, names, values, title)
     plt.tight_layout()
     plt.show()
 
-def main():
-    parser = argparse.ArgumentParser(description="Plot pellets eaten for Day 1 (col 2) and Day 2 (col 4) vs time (col 1).")
+def watch_graph(path: str, title: str, poll: float = 1.0, refresh: float = 5.0):
+    """
+    Follow a CSV that is still being written: parse only the rows appended since the last
+    check and redraw the graph at most every `refresh` seconds. Runs until the window is
+    closed or Ctrl+C.
+    """
+    import matplotlib.pyplot as plt
+    import numpy as np
+    follower = FileFollower(path)
+    throttle = Throttle(refresh)
+    labels: List[str] = []
+    day1: List[float] = []
+    day2: List[float] = []
+    header_checked = False
+    changed = False
+
+    plt.ion()
+    fig = plt.figure(figsize=(10, 5))
+    ax = fig.gca()
+    try:
+        while plt.fignum_exists(fig.number):
+            lines = follower.read_lines()
+            if follower.restarted:
+                labels, day1, day2 = [], [], []
+                header_checked = False
+                changed = True
+            rows = list(csv.reader(lines, delimiter=follower.delimiter))
+            if rows and not header_checked:
+                if looks_like_header(rows[0]):
+                    rows = rows[1:]
+                header_checked = True
+            if rows:
+                new_labels, new_day1, new_day2 = parse_rows(rows)
+                labels += new_labels
+                day1 += new_day1
+                day2 += new_day2
+                changed = changed or bool(new_labels)
+
+            if changed and throttle.ready():
+                ax.clear()
+                draw_graph(ax, labels, list(DEFAULT_SERIES.values()), np.array([day1, day2]), title)
+                fig.tight_layout()
+                fig.canvas.draw_idle()
+                changed = False
+            plt.pause(poll)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        plt.ioff()
+
+def render_graph(labels: List[str], names: List[str], values: np.ndarray, title: str,
+                 output_paths: List[str]):
+    # A bare Figure draws with Agg (PNG) or the vector backends (SVG/PDF) chosen from the file
+    # extension, without pyplot or a display
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(10, 5))
+    draw_graph(fig.gca(), labels, names, values, title)
+    fig.tight_layout()
+    for output_path in output_paths:
+        fig.savefig(output_path)
+
+def read_titles(path: str) -> Dict[str, str]:
+    """
+    Titles from a two-column CSV: file name (with or without .csv) and graph title.
+    A first row of "file,title" is skipped.
+    """
+    titles = {}
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip():
+                continue
+            name, title = row[0].strip(), row[1].strip()
+            if (name.lower(), title.lower()) == ("file", "title"):
+                continue
+            titles[name] = title
+    return titles
+
+def title_for(path: str, titles: Dict[str, str]) -> str:
+    # Mapped by file name, then by name without extension; defaults to the name without extension
+    name = Path(path).name
+    return titles.get(name, titles.get(Path(path).stem, Path(path).stem))
+
+def render_file(path: str, title: str, formats: List[str], output_dir: Optional[str],
+                pattern: Optional[str] = None, stats: bool = False) -> Dict:
+    """
+    Worker for the batch mode: graph one CSV and save it as <name>.<format> for each
+    format in output_dir (or next to the CSV). Returns a summary dict, with the
+    series_stats() table as text when stats is set.
+    """
+    start = time.perf_counter()
+    summary = {"file": path, "rows": 0, "outputs": [], "stats": None, "seconds": 0.0, "error": None}
+    try:
+        labels, names, values = process_csv(path, pattern)
+        folder = Path(output_dir) if output_dir else Path(path).parent
+        outputs = [str(folder / f"{Path(path).stem}.{fmt}") for fmt in formats]
+        render_graph(labels, names, values, title, outputs)
+        summary.update(rows=len(labels), outputs=outputs)
+        if stats:
+            summary["stats"] = series_stats(labels, names, values).to_string(index=False)
+    except Exception as e:
+        summary["error"] = str(e)
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+def batch_main(args) -> int:
+    from data_loader import CSV_EXTENSIONS, collect_files
+    paths = collect_files(args.files, CSV_EXTENSIONS)
+    if not paths:
+        print("No CSV files found.", file=sys.stderr)
+        return 1
+    try:
+        titles = read_titles(args.titles) if args.titles else {}
+    except OSError as e:
+        print(f"Error reading titles: {e}", file=sys.stderr)
+        return 1
+    if args.output_dir:
+        # Files from different folders must not overwrite each other's images
+        stems = [Path(p).stem for p in paths]
+        clashes = sorted({stem for stem in stems if stems.count(stem) > 1})
+        if clashes:
+            print(f"Several inputs would be saved as {', '.join(clashes)} in {args.output_dir}; "
+                  f"render them to separate folders.", file=sys.stderr)
+            return 1
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    workers = max(1, min(args.workers or 1, len(paths)))
+    print(f"Rendering {len(paths)} files with {workers} workers...")
+    start = time.perf_counter()
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        worker = partial(render_file, formats=args.format, output_dir=args.output_dir,
+                         pattern=args.columns, stats=args.stats)
+        for summary in executor.map(worker, paths, [title_for(p, titles) for p in paths]):
+            if summary["error"]:
+                failed.append(summary)
+                print(f"Error processing {Path(summary['file']).name}: {summary['error']}", file=sys.stderr)
+            else:
+                print(f"Saved {', '.join(summary['outputs'])} ({summary['rows']} rows, {summary['seconds']:.2f} s)")
+                if summary["stats"]:
+                    print(summary["stats"])
+    elapsed = time.perf_counter() - start
+
+    print(f"\nRendered {len(paths) - len(failed)} of {len(paths)} files in {elapsed:.2f} s: "
+          f"{len(paths) / elapsed:.1f} files/s")
+    if failed:
+        print(f"{len(failed)} failed:")
+        for summary in failed:
+            print(f"  {summary['file']}: {summary['error']}")
+    return 1 if failed else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Plot pellets eaten for Day 1 (col 2) and Day 2 (col 4), or for the columns "
+                    "matching --columns, vs time (col 1).")
+    parser.add_argument("files", nargs="*",
+                        help="CSV files, directories or glob patterns to render to image files without "
+                             "opening a window (batch mode).")
     parser.add_argument("--file", "-f", type=str, help="Path to CSV file.")
     parser.add_argument("--title", "-t", type=str, help="Graph title.")
-    args = parser.parse_args()
+    parser.add_argument("--columns", "-c", default=None,
+                        help="Plot every column whose header matches this pattern, e.g. '*_pellet_count' "
+                             "for a fed_extract_columns.py masterfile (default: columns 2 and 4).")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print readings, peak, peak time and last value of each series.")
+    parser.add_argument("--watch", "-w", action="store_true",
+                        help="Follow a CSV that is still being written and redraw the graph as it grows.")
+    parser.add_argument("--refresh", type=float, default=5.0,
+                        help="Minimum seconds between redraws in --watch mode (default: 5).")
+    parser.add_argument("--output-dir", "-o", default=None,
+                        help="Batch mode: folder for the rendered files (default: next to each CSV).")
+    parser.add_argument("--format", nargs="+", choices=["png", "svg", "pdf"], default=["png"],
+                        help="Batch mode: file formats to write (default: png).")
+    parser.add_argument("--titles", default=None,
+                        help="Batch mode: CSV of file name,title pairs; other files are titled by their name.")
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count(),
+                        help="Batch mode: number of worker processes (default: one per core).")
+    args = parser.parse_args(argv)
+    if args.watch and args.columns:
+        parser.error("--watch plots columns 2 and 4 only; it cannot be combined with --columns")
+
+    if args.files:
+        sys.exit(batch_main(args))
 
     csv_path = args.file
     if not csv_path:
@@ -175,13 +465,19 @@ def main():
 
     title = args.title if args.title is not None else input("Enter graph title (or leave blank): ").strip()
 
+    if args.watch:
+        watch_graph(csv_path, title, refresh=args.refresh)
+        return
+
     try:
-        labels, d1, d2 = process_csv(csv_path)
+        labels, names, values = process_csv(csv_path, args.columns)
     except Exception as e:
         print(f"Error reading CSV: {e}", file=sys.stderr)
         sys.exit(1)
 
-    plot_graph(labels, d1, d2, title)
+    if args.stats:
+        print(series_stats(labels, names, values).to_string(index=False))
+    plot_graph(labels, names, values, title)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,106 @@
+#shared instrumentation for the FED scripts (count_strategies.py, fed_extract_columns.py)
+"""
+Per-stage timing and row counts.
+
+A StageRecorder times named stages (read, timestamp parse, cutoff filter, ...) and records
+their wall time, rows in and out and the change in process memory. Repeated stages of the same
+file, such as one timestamp parse per CSV chunk, add up into one record. Records can be written
+as JSON lines or summarized as a table. log() replaces print() for progress output so a quiet
+recorder turns all of it off.
+"""
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+def current_memory_mb():
+    """Resident memory of this process in MB, or None where it cannot be read"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1e6
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class StageRecorder:
+    """Records wall time, rows and memory per (file, stage).
+
+    Stages may nest; a stage's time includes the stages inside it. Set context to the file
+    being processed so its stages are recorded separately from other files.
+    """
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self.context = None
+        self.records = {}
+
+    def log(self, *args, **kwargs):
+        if not self.quiet:
+            print(*args, **kwargs)
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Time the body of a with-block as stage `name`. The yielded dict takes the stage's
+        'rows_in' (if not passed here) and 'rows_out'."""
+        counts = {'rows_in': rows_in, 'rows_out': None}
+        memory_before = current_memory_mb()
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - start
+            memory_after = current_memory_mb()
+            record = self.records.setdefault((self.context, name), {
+                'file': self.context, 'stage': name, 'calls': 0, 'seconds': 0.0,
+                'rows_in': None, 'rows_out': None, 'memory_delta_mb': None,
+            })
+            record['calls'] += 1
+            record['seconds'] += seconds
+            for key in ('rows_in', 'rows_out'):
+                if counts[key] is not None:
+                    record[key] = (record[key] or 0) + int(counts[key])
+            if memory_before is not None and memory_after is not None:
+                record['memory_delta_mb'] = (record['memory_delta_mb'] or 0.0) + memory_after - memory_before
+
+    def take_records(self):
+        """Return the records so far, in the order their stages first ran, and start over"""
+        records = list(self.records.values())
+        self.records = {}
+        return records
+
+def write_json_lines(records, path):
+    """Write stage records as one JSON object per line; path '-' writes to stdout"""
+    lines = ''.join(json.dumps(record) + '\n' for record in records)
+    if path == '-':
+        sys.stdout.write(lines)
+    else:
+        with open(path, 'w') as f:
+            f.write(lines)
+
+def summarize(records):
+    """Total the stage records of all files into one row per stage, in stage order"""
+    if not records:
+        return pd.DataFrame(columns=['files', 'calls', 'seconds', 'rows_in', 'rows_out',
+                                     'rows_per_sec', 'memory_delta_mb'])
+    df = pd.DataFrame(records)
+    # Stages that never reported a row count stay missing instead of summing to 0
+    total = lambda values: values.sum(min_count=1)
+    summary = df.groupby('stage', sort=False).agg(
+        files=('file', 'nunique'),
+        calls=('calls', 'sum'),
+        seconds=('seconds', 'sum'),
+        rows_in=('rows_in', total),
+        rows_out=('rows_out', total),
+        memory_delta_mb=('memory_delta_mb', total),
+    )
+    summary.insert(5, 'rows_per_sec', (summary['rows_in'] / summary['seconds']).round())
+    summary = summary.astype({'rows_in': 'Int64', 'rows_out': 'Int64', 'rows_per_sec': 'Int64'})
+    return summary.round({'seconds': 4, 'memory_delta_mb': 1})
@@ -0,0 +1,276 @@
+#shared time helpers for the FED scripts (count_strategies.py, fed_extract_columns.py, fed_pellet_graph.py)
+"""
+Fast timestamp parsing and elapsed-time formatting for FED device logs.
+
+pd.to_datetime without a format falls back to slow per-element parsing on FED3's
+"MM/DD/YYYY HH:MM:SS" strings. parse_timestamps() detects the format once from a small
+sample and parses the whole column with it. Zero-padded formats such as FED3's are decoded
+as fixed-width digit arrays in NumPy, and rows without the zero padding (3/5/2024 9:03:07) as
+variable-width ones; only the rows that do not match go through the slow path. Detected
+formats are remembered per signature (by default the column header), so later files and
+chunks from the same device skip the detection.
+
+format_hms() and parse_hms() convert between elapsed seconds and "HH:MM:SS" labels for whole
+arrays at once, with integer division and bulk string concatenation instead of a timedelta
+and an f-string per row.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Formats tried in order; FED3 writes the first one
+TIMESTAMP_FORMATS = [
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%m:%d:%Y %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y/%m/%d %H:%M:%S',
+    '%m/%d/%y %H:%M:%S',
+    '%d/%m/%Y %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+]
+
+SAMPLE_SIZE = 100
+
+# Zero-padded directives the fixed-width fast path can decode: name and width
+FIXED_WIDTH_FIELDS = {
+    '%Y': ('year', 4), '%m': ('month', 2), '%d': ('day', 2),
+    '%H': ('hour', 2), '%M': ('minute', 2), '%S': ('second', 2),
+}
+
+# signature -> detected format
+_format_cache = {}
+
+def detect_timestamp_format(sample):
+    """Return the format in TIMESTAMP_FORMATS that parses the most values of sample,
+    or None when none of them parses more than half of it"""
+    best_fmt, best_matches = None, len(sample) // 2
+    for fmt in TIMESTAMP_FORMATS:
+        matches = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if matches == len(sample):
+            return fmt
+        if matches > best_matches:
+            best_fmt, best_matches = fmt, matches
+    return best_fmt
+
+def fixed_width_layout(fmt):
+    """Return (length, {field: (start, width)}, {position: separator byte}) for a format made
+    only of FIXED_WIDTH_FIELDS and single-byte separators, or None"""
+    length, fields, separators = 0, {}, {}
+    i = 0
+    while i < len(fmt):
+        if fmt[i] == '%':
+            if fmt[i:i + 2] not in FIXED_WIDTH_FIELDS:
+                return None
+            name, width = FIXED_WIDTH_FIELDS[fmt[i:i + 2]]
+            fields[name] = (length, width)
+            length += width
+            i += 2
+        else:
+            if ord(fmt[i]) > 127:
+                return None
+            separators[length] = ord(fmt[i])
+            length += 1
+            i += 1
+    if not {'year', 'month', 'day'} <= set(fields):
+        return None
+    return length, fields, separators
+
+def parse_fixed_width(values, layout):
+    """Decode fixed-width timestamp strings as digit arrays; rows that do not fit give NaT.
+    Returns None when the values are not plain ASCII."""
+    length, fields, separators = layout
+    text = values.astype(object)
+    fits = np.array(text.str.len() == length, dtype=bool)
+    try:
+        encoded = text[fits].to_numpy(dtype=f'S{length}')
+    except UnicodeEncodeError:
+        return None
+    raw = np.zeros((len(values), length), dtype=np.uint8)
+    raw[fits] = encoded.view(np.uint8).reshape(-1, length)
+
+    for position, byte in separators.items():
+        fits &= raw[:, position] == byte
+    digits = raw.astype(np.int16) - ord('0')
+    parts = {}
+    for name, (start, width) in fields.items():
+        block = digits[:, start:start + width]
+        fits &= ((block >= 0) & (block <= 9)).all(axis=1)
+        parts[name] = block @ (10 ** np.arange(width - 1, -1, -1))
+    parts = pd.DataFrame(parts)
+    # Placeholder date for rows that do not fit; they are set to NaT below
+    parts.loc[~fits, ['year', 'month', 'day']] = (1970, 1, 1)
+    parsed = pd.to_datetime(parts, errors='coerce')
+    parsed[~fits] = pd.NaT
+    parsed.index = values.index
+    parsed.name = values.name
+    return parsed
+
+def numeric_layout(fmt):
+    """Return ([(field, most digits), ...], [separator byte, ...]) for a format of
+    FIXED_WIDTH_FIELDS with a single ASCII separator between each two of them, or None"""
+    fields, separators = [], []
+    i = 0
+    while i < len(fmt):
+        if len(fields) == len(separators):
+            if fmt[i:i + 2] not in FIXED_WIDTH_FIELDS:
+                return None
+            fields.append(FIXED_WIDTH_FIELDS[fmt[i:i + 2]])
+            i += 2
+        else:
+            if fmt[i] == '%' or ord(fmt[i]) > 127:
+                return None
+            separators.append(ord(fmt[i]))
+            i += 1
+    if len(fields) != len(separators) + 1 or not {'year', 'month', 'day'} <= {name for name, _ in fields}:
+        return None
+    return fields, separators
+
+def parse_numeric(values, layout):
+    """Decode timestamp strings as digit arrays, zero-padded (03/05/2024 09:03:07) or not
+    (3/5/2024 9:03:07); rows that do not fit give NaT. Years need all four digits.
+    Returns None when the values are not plain ASCII."""
+    fields, separators = layout
+    min_length = len(fields) + len(separators)
+    max_length = sum(width for _, width in fields) + len(separators)
+    text = values.astype(object)
+    lengths = text.str.len()
+    fits = np.array((lengths >= min_length) & (lengths <= max_length), dtype=bool)
+    try:
+        encoded = text[fits].to_numpy(dtype=f'S{max_length}')
+    except UnicodeEncodeError:
+        return None
+    # Shorter strings are padded with zero bytes
+    raw = np.zeros((len(values), max_length), dtype=np.uint8)
+    raw[fits] = encoded.view(np.uint8).reshape(-1, max_length)
+
+    # Walk the characters left to right: digits build up the current field, and each
+    # separator must be the next one of the format and moves on to the next field
+    rows = np.arange(len(values))
+    field = np.zeros(len(values), dtype=np.int64)
+    numbers = np.zeros((len(values), len(fields)), dtype=np.int64)
+    digit_counts = np.zeros((len(values), len(fields)), dtype=np.int64)
+    # A zero after the last separator: no further separator is expected
+    expected = np.array(separators + [0], dtype=np.uint8)
+    for column in raw.T:
+        digit = (column >= ord('0')) & (column <= ord('9'))
+        separator = ~digit & (column != 0)
+        row, current = rows[digit], field[digit]
+        numbers[row, current] = numbers[row, current] * 10 + (column[digit] - ord('0'))
+        digit_counts[row, current] += 1
+        fits &= ~separator | (expected[field] == column)
+        field = np.minimum(field + separator, len(separators))
+
+    most_digits = np.array([width for _, width in fields])
+    fits &= (field == len(separators)) & (digit_counts >= 1).all(axis=1) & (digit_counts <= most_digits).all(axis=1)
+    year = [name for name, _ in fields].index('year')
+    fits &= digit_counts[:, year] == 4
+
+    parts = pd.DataFrame({name: numbers[:, i] for i, (name, _) in enumerate(fields)})
+    # Placeholder date for rows that do not fit; they are set to NaT below
+    parts.loc[~fits, ['year', 'month', 'day']] = (1970, 1, 1)
+    parsed = pd.to_datetime(parts, errors='coerce')
+    parsed[~fits] = pd.NaT
+    parsed.index = values.index
+    parsed.name = values.name
+    return parsed
+
+def parse_with_format(values, fmt):
+    """Vectorized parse of values with fmt; rows that do not match give NaT"""
+    layout = fixed_width_layout(fmt)
+    if layout is not None:
+        parsed = parse_fixed_width(values, layout)
+        if parsed is not None:
+            # Rows of another width, e.g. without zero padding (3/5/2024 9:03:07), go through
+            # the variable-width digit arrays and then pandas with the format, so only real
+            # mismatches reach the slow path
+            misfit = parsed.isna() & values.notna()
+            numeric = numeric_layout(fmt)
+            if misfit.any() and numeric is not None:
+                rest = parse_numeric(values[misfit], numeric)
+                if rest is not None:
+                    parsed[misfit] = rest
+                    misfit = parsed.isna() & values.notna()
+            if misfit.any():
+                parsed[misfit] = pd.to_datetime(values[misfit], format=fmt, errors='coerce')
+            return parsed
+    return pd.to_datetime(values, format=fmt, errors='coerce')
+
+def parse_timestamps(values, signature=None):
+    """Parse a Series of timestamp strings into datetime64 values.
+
+    signature identifies the device or file layout the values come from (default: the
+    Series name) and keys the cache of detected formats. Rows that do not match the
+    format are parsed one by one like pd.to_datetime, which raises on unparseable values.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    if signature is None:
+        signature = values.name
+
+    present = values.notna()
+    sample = values[present].head(SAMPLE_SIZE).astype(str)
+    if sample.empty:
+        return pd.to_datetime(values)
+
+    fmt = _format_cache.get(signature)
+    if fmt is None or pd.to_datetime(sample, format=fmt, errors='coerce').isna().any():
+        fmt = detect_timestamp_format(sample)
+        if fmt is None:
+            return pd.to_datetime(values)
+        _format_cache[signature] = fmt
+
+    parsed = parse_with_format(values, fmt)
+    # Slow path only for the rows the format did not match
+    unmatched = parsed.isna() & present
+    if unmatched.any():
+        parsed[unmatched] = pd.to_datetime(values[unmatched].astype(str))
+    return parsed
+
+# "00" to "59", indexed by the minute or second
+TWO_DIGITS = np.array([f'{i:02d}' for i in range(60)])
+
+def format_hms(seconds, pad_hours=True):
+    """Format elapsed seconds as "HH:MM:SS" strings (or "H:MM:SS" like str(timedelta) when
+    pad_hours is False). Seconds are rounded to whole seconds and negative values count as 0.
+    Missing values give ''. Returns a NumPy array of str."""
+    values = np.asarray(seconds, dtype=float)
+    missing = ~np.isfinite(values)
+    total = np.maximum(0, np.round(np.where(missing, 0, values))).astype(np.int64)
+    hours, rest = np.divmod(total, 3600)
+    minutes, secs = np.divmod(rest, 60)
+
+    hours = hours.astype(str)
+    if pad_hours:
+        hours = np.char.zfill(hours, 2)
+    labels = np.char.add(np.char.add(np.char.add(hours, ':'), TWO_DIGITS[minutes]),
+                         np.char.add(':', TWO_DIGITS[secs]))
+    labels[missing] = ''
+    return labels
+
+def parse_hms(values):
+    """Parse "HH:MM:SS", "MM:SS" or plain-seconds strings into elapsed seconds (float array).
+    Each colon-separated part is truncated to a whole number and negative parts count as 0;
+    only the last three parts are used. Empty or unparseable values give NaN."""
+    text = pd.Series(values, dtype=object).astype(str).str.strip()
+    seconds = np.full(len(text), np.nan)
+    timelike = text.str.contains(':', regex=False).to_numpy()
+
+    # Plain seconds
+    plain = pd.to_numeric(text[~timelike], errors='coerce').to_numpy(dtype=float)
+    seconds[~timelike] = np.where(np.isfinite(plain), plain, np.nan)
+
+    if timelike.any():
+        parts = text[timelike].str.split(':', expand=True)
+        numbers = parts.apply(lambda col: pd.to_numeric(col, errors='coerce')).to_numpy(dtype=float)
+        present = parts.notna().to_numpy()
+        valid = (np.isfinite(numbers) | ~present).all(axis=1)
+
+        # Right-align the parts so the last three are hours, minutes and seconds
+        n_parts = present.sum(axis=1)
+        columns = n_parts[:, None] - 3 + np.arange(3)
+        aligned = np.take_along_axis(np.nan_to_num(numbers), np.maximum(columns, 0), axis=1)
+        aligned = np.maximum(0, np.trunc(np.where(columns >= 0, aligned, 0)))
+        seconds[timelike] = np.where(valid, aligned @ np.array([3600, 60, 1]), np.nan)
+    return seconds